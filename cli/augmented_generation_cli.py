@@ -1,8 +1,7 @@
 import argparse
 from lib.evaluation_util import load_movies
 from lib.hybrid_search import HybridSearch
-from google import genai
-from dotenv import load_dotenv
+from lib.search_client import SearchClient
 import os
 
 def main():
@@ -30,8 +29,11 @@ def main():
     question_parser.add_argument("--k", type=int, default=60, help="Weight for ranking")
 
     args = parser.parse_args()
-    movies = load_movies()
-    hybrid_search = HybridSearch(movies["movies"])
+    if args.command is None:
+        parser.print_help()
+        return
+    # a running search server answers the searches, otherwise they run in this process
+    hybrid_search = SearchClient.connect() or HybridSearch(load_movies()["movies"])
     match args.command:
         case "rag":
             query = args.query
@@ -73,10 +75,16 @@ def main():
         case _:
             parser.print_help()
 
-def gemini_4(question, context):
+def gemini_client():
+    # google.genai is slow to import, only commands that generate an answer import it
+    from dotenv import load_dotenv
+    from google import genai
     load_dotenv()
     api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+    return genai.Client(api_key=api_key)
+
+def gemini_4(question, context):
+    client = gemini_client()
     content = client.models.generate_content(model="gemini-2.5-flash", contents=get_prompt_4(question, context))
     return content.text
 
@@ -98,9 +106,7 @@ def get_prompt_4(question, context):
 
             Answer:"""
 def gemini_3(query, documents):
-    load_dotenv()
-    api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+    client = gemini_client()
     content = client.models.generate_content(model="gemini-2.5-flash", contents=get_prompt_3(query, documents))
     return content.text
 
@@ -125,9 +131,7 @@ def get_prompt_3(query, documents):
 
                 Answer:"""
 def gemini_2(query, results):
-    load_dotenv()
-    api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+    client = gemini_client()
     content = client.models.generate_content(model="gemini-2.5-flash", contents=get_prompt_2(query, results))
     return content.text
 
@@ -144,9 +148,7 @@ def get_prompt_2(query, results):
             """
 
 def gemini_1(query, docs):
-    load_dotenv()
-    api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+    client = gemini_client()
     content = client.models.generate_content(model="gemini-2.5-flash", contents=get_prompt_1(query, docs))
     return content.text
 
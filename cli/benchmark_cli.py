@@ -0,0 +1,114 @@
+import argparse
+from lib.benchmark import DEFAULT_CORPUS_SIZES, DEFAULT_UPDATE_SIZES, DEFAULT_SWEEP_K1, DEFAULT_SWEEP_B, cmd_bench_bm25_sweep, cmd_bench_phrase, cmd_bench_resident, cmd_bench_top_k, DEFAULT_SELECTION_SIZES, cmd_bench_ann, DEFAULT_NPROBES, cmd_bench_quantization, cmd_bench_batch_scoring, DEFAULT_BATCH_SIZES, cmd_bench_hybrid_legs, cmd_bench_startup, DEFAULT_STARTUP_COMMANDS, cmd_bench_result_cache, cmd_bench_bm25, cmd_bench_bm25_top_k, cmd_bench_index_load, cmd_bench_build, cmd_bench_update
+from lib.search_utils import HYBRID_LEG_WORKERS
+from lib.quantization import QUANTIZATION_KINDS
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    bm25_parser = subparsers.add_parser("bm25", help="Compare full-scan and postings-based BM25 scoring across corpus sizes")
+    bm25_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_CORPUS_SIZES, help="Corpus sizes to benchmark")
+    bm25_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    bm25_parser.add_argument("--repeat", type=int, default=3, help="Runs per query")
+
+    bm25_top_k_parser = subparsers.add_parser("bm25-topk", help="Compare exhaustive and MaxScore top-k BM25 search")
+    bm25_top_k_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_CORPUS_SIZES, help="Corpus sizes to benchmark")
+    bm25_top_k_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    bm25_top_k_parser.add_argument("--repeat", type=int, default=3, help="Runs per query")
+
+    index_load_parser = subparsers.add_parser("index-load", help="Compare pickled and memory-mapped keyword index load time")
+    index_load_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_CORPUS_SIZES, help="Corpus sizes to benchmark")
+    index_load_parser.add_argument("--repeat", type=int, default=5, help="Loads per corpus size")
+
+    build_parser = subparsers.add_parser("build", help="Compare serial and parallel keyword index builds")
+    build_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8], help="Process counts to benchmark")
+    build_parser.add_argument("--repeat", type=int, default=1, help="Builds per process count")
+
+    update_parser = subparsers.add_parser("update", help="Compare incremental keyword index updates with a full rebuild")
+    update_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_UPDATE_SIZES, help="Numbers of edited documents to benchmark")
+    update_parser.add_argument("--repeat", type=int, default=1, help="Runs per update size")
+
+    bm25_sweep_parser = subparsers.add_parser("bm25-sweep", help="Evaluate BM25 k1/b settings on the golden dataset")
+    bm25_sweep_parser.add_argument("--k1", type=float, nargs="+", default=DEFAULT_SWEEP_K1, help="k1 values to try")
+    bm25_sweep_parser.add_argument("--b", type=float, nargs="+", default=DEFAULT_SWEEP_B, help="b values to try")
+    bm25_sweep_parser.add_argument("--limit", type=int, default=5, help="Number of results to evaluate (k for precision@k, recall@k)")
+
+    phrase_parser = subparsers.add_parser("phrase", help="Compare phrase lookups on a positional index with BM25")
+    phrase_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    phrase_parser.add_argument("--repeat", type=int, default=3, help="Runs per query")
+
+    resident_parser = subparsers.add_parser("resident", help="Compare reloading the saved keyword index per query with keeping it resident")
+    resident_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    resident_parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+
+    top_k_parser = subparsers.add_parser("topk", help="Compare full sorting with top-k selection of dense scores")
+    top_k_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SELECTION_SIZES, help="Numbers of scores to select from")
+    top_k_parser.add_argument("--limit", type=int, default=10, help="Number of results to select")
+    top_k_parser.add_argument("--repeat", type=int, default=3, help="Runs per size")
+
+    ann_parser = subparsers.add_parser("ann", help="Recall and latency of the chunk ANN index against exhaustive search")
+    ann_parser.add_argument("--nprobe", type=int, nargs="+", default=DEFAULT_NPROBES, help="Lists scanned per query")
+    ann_parser.add_argument("--limit", type=int, default=10, help="k for recall@k")
+    ann_parser.add_argument("--queries", type=int, default=200, help="Number of sampled query chunks")
+
+    quantize_parser = subparsers.add_parser("quantize", help="Memory and recall of quantized chunk embeddings against float32")
+    quantize_parser.add_argument("--kinds", choices=QUANTIZATION_KINDS, nargs="+", default=QUANTIZATION_KINDS, help="Quantizations to compare")
+    quantize_parser.add_argument("--limit", type=int, default=10, help="k for recall@k")
+    quantize_parser.add_argument("--queries", type=int, default=200, help="Number of sampled query chunks")
+
+    batch_parser = subparsers.add_parser("batch", help="Chunk scoring one query at a time against one matrix product per batch")
+    batch_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES, help="Queries per batch")
+    batch_parser.add_argument("--limit", type=int, default=10, help="Results selected per query")
+    batch_parser.add_argument("--repeat", type=int, default=3, help="Runs per batch size")
+
+    hybrid_parser = subparsers.add_parser("hybrid-legs", help="Hybrid search latency with sequential and concurrent BM25 and semantic legs")
+    hybrid_parser.add_argument("--workers", type=int, default=HYBRID_LEG_WORKERS, help="Threads of the leg pool")
+    hybrid_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    hybrid_parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+
+    startup_parser = subparsers.add_parser("startup", help="Startup time and heavy imports of CLI commands")
+    startup_parser.add_argument("--commands", type=str, nargs="+", default=DEFAULT_STARTUP_COMMANDS, help="CLI invocations, script and arguments, run from the cli directory")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="Runs per command")
+
+    result_cache_parser = subparsers.add_parser("result-cache", help="Hybrid search latency searched, from the result cache in memory and on disk")
+    result_cache_parser.add_argument("--limit", type=int, default=5, help="Number of results per query")
+    result_cache_parser.add_argument("--repeat", type=int, default=5, help="Runs of the cached queries")
+
+    args = parser.parse_args()
+    match args.command:
+        case "bm25":
+            cmd_bench_bm25(args.sizes, args.limit, args.repeat)
+        case "bm25-topk":
+            cmd_bench_bm25_top_k(args.sizes, args.limit, args.repeat)
+        case "index-load":
+            cmd_bench_index_load(args.sizes, args.repeat)
+        case "build":
+            cmd_bench_build(args.workers, args.repeat)
+        case "update":
+            cmd_bench_update(args.sizes, args.repeat)
+        case "bm25-sweep":
+            cmd_bench_bm25_sweep(args.k1, args.b, args.limit)
+        case "phrase":
+            cmd_bench_phrase(args.limit, args.repeat)
+        case "resident":
+            cmd_bench_resident(args.limit, args.repeat)
+        case "topk":
+            cmd_bench_top_k(args.sizes, args.limit, args.repeat)
+        case "ann":
+            cmd_bench_ann(args.nprobe, args.limit, args.queries)
+        case "quantize":
+            cmd_bench_quantization(args.kinds, args.limit, args.queries)
+        case "batch":
+            cmd_bench_batch_scoring(args.sizes, args.limit, args.repeat)
+        case "hybrid-legs":
+            cmd_bench_hybrid_legs(args.workers, args.limit, args.repeat)
+        case "startup":
+            cmd_bench_startup(args.commands, args.repeat)
+        case "result-cache":
+            cmd_bench_result_cache(args.limit, args.repeat)
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
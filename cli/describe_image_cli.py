@@ -1,8 +1,5 @@
 import argparse
 import mimetypes
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
 import os
 
 def main():
@@ -10,6 +7,9 @@ def main():
     desc_img_parser.add_argument("--image", type=str, help="Path to image")
     desc_img_parser.add_argument("--query", type=str, help="Query")
     args = desc_img_parser.parse_args()
+    from dotenv import load_dotenv
+    from google import genai
+    from google.genai import types
     
     mime, _ = mimetypes.guess_type(args.image)
     mime = mime or "image/jpeg"
@@ -1,6 +1,7 @@
 import argparse
 from lib.evaluation_util import load_golden_set, load_movies
 from lib.hybrid_search import HybridSearch
+from lib.search_client import SearchClient
 
 def main():
     parser = argparse.ArgumentParser(description="Search Evaluation CLI")
@@ -10,14 +11,15 @@ def main():
         default=5,
         help="Number of results to evaluate (k for precision@k, recall@k)",
     )
-    hybrid_search = HybridSearch(load_movies()["movies"])
     args = parser.parse_args()
+    hybrid_search = SearchClient.connect() or HybridSearch(load_movies()["movies"])
     limit = args.limit
 
     test_cases = load_golden_set()
-    for test_case in test_cases:
+    # every golden query is searched in one batch
+    all_retrieved_docs = hybrid_search.rrf_search_many([test_case["query"] for test_case in test_cases], k=60, limit=limit)
+    for test_case, retrieved_docs in zip(test_cases, all_retrieved_docs):
         query = test_case["query"]
-        retrieved_docs = hybrid_search.rrf_search(query=query, k=60, limit=limit)
         
         retrieved_titles =[]
         for doc in retrieved_docs:
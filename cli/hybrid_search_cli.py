@@ -1,12 +1,9 @@
 import argparse
 from lib.hybrid_search import cmd_normalize_score, HybridSearch
+from lib.search_client import SearchClient
 from lib.search_utils import load_movies, gemini_query_spell, gemini_query_rewrite, gemini_query_expand,gemini_query_rerank, gemini_query_batch
 import os
-from dotenv import load_dotenv
-from google import genai
-from google.genai import errors as genai_errors
 import time, json
-from sentence_transformers import CrossEncoder
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid Search CLI")
@@ -29,15 +26,18 @@ def main() -> None:
     rrf_search_parser.add_argument("--evaluate", action="store_true", help="determines if query should be evaluated")
 
     args = parser.parse_args()
-    hybrid_search = HybridSearch(load_movies()["movies"])
+    # only the search commands load the indexes, or ask a running search server, genai and the cross
+    # encoder are imported where they are used
     match args.command:
         case "normalize":
             cmd_normalize_score(args.scores)
         case "weighted-search":
+            hybrid_search = SearchClient.connect() or HybridSearch(load_movies()["movies"])
             results = hybrid_search.weighted_search(args.query, args.alpha, args.limit)
             for i, result in enumerate(results, start=1):
                 print(f"{i} {result["title"]}\nHybrid Score: {result["hybrid_score"]}\n BM25: {result["bm25_score"]}, Semantic:{result["semantic_score"]}\n{result["document"]}")
         case "rrf-search":
+            hybrid_search = SearchClient.connect() or HybridSearch(load_movies()["movies"])
             initial_limit = args.limit
             if args.rerank_method:
                 limit = initial_limit * 5
@@ -75,6 +75,7 @@ def main() -> None:
                         f"{doc['document'][:200]}\n")
                         
                 elif args.rerank_method == "cross_encoder":
+                    from sentence_transformers import CrossEncoder
                     pairs = []
                     cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
                     for doc in results:
@@ -108,6 +109,9 @@ def main() -> None:
             parser.print_help()
 
 def generate_gemini_response(query, choice, doc, doc_list_str):
+    from dotenv import load_dotenv
+    from google import genai
+    from google.genai import errors as genai_errors
     load_dotenv()
     api_key = os.environ.get("GEMINI_API_KEY")
     client = genai.Client(api_key=api_key)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
-from lib.inverted_index import InvertedIndex
+from lib.inverted_index import InvertedIndex, cmd_convert_pickles, cmd_add_documents, cmd_delete_documents, cmd_merge_segments, cmd_sync_documents
 from lib import search
 from lib.search_utils import BM25_K1, BM25_B
 import os
@@ -13,7 +13,16 @@ def main() -> None:
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
 
-    subparsers.add_parser("build", help="Build inverted index")
+    build_parser = subparsers.add_parser("build", help="Build inverted index")
+    build_parser.add_argument("--workers", type=int, default=1, help="Processes to tokenize the corpus with")
+    build_parser.add_argument("--positions", action="store_true", help="Store word positions for phrase and proximity search")
+    subparsers.add_parser("convert", help="Convert the pickled index to the memory-mapped format")
+    add_parser = subparsers.add_parser("add", help="Add or update documents without rebuilding the index")
+    add_parser.add_argument("path", type=str, help="JSON file with a list of movies or a {\"movies\": [...]} object")
+    delete_parser = subparsers.add_parser("delete", help="Delete documents from the index")
+    delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Document IDs to delete")
+    subparsers.add_parser("merge", help="Merge all index segments into one and drop deleted documents")
+    subparsers.add_parser("sync", help="Apply changes in the movies file to the index")
     tf_parser = subparsers.add_parser("tf", help="Get term frequency")
     tf_parser.add_argument("doc_id", type=int, help="Document ID")
     tf_parser.add_argument("term", type=str, help="Term to get the frequency for")
@@ -37,6 +46,18 @@ def main() -> None:
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
     bm25search_parser.add_argument("query", type=str, help="Search query")
     bm25search_parser.add_argument("--limit", type=int,  default=5, help="Limit for scores") 
+    bm25search_parser.add_argument("--exhaustive", action="store_true", help="Score every matching document instead of MaxScore top-k pruning")
+    bm25search_parser.add_argument("--k1", type=float, default=BM25_K1, help="Tunable BM25 K1 parameter")
+    bm25search_parser.add_argument("--b", type=float, default=BM25_B, help="Tunable BM25 b parameter")
+
+    phrase_parser = subparsers.add_parser("phrase", help="Search movies containing an exact phrase")
+    phrase_parser.add_argument("query", type=str, help="Phrase to search for")
+    phrase_parser.add_argument("--limit", type=int, default=5, help="Limit for scores")
+
+    near_parser = subparsers.add_parser("near", help="Search movies containing all query words close together")
+    near_parser.add_argument("query", type=str, help="Search query")
+    near_parser.add_argument("--distance", type=int, default=5, help="Largest span in words that may hold all query words")
+    near_parser.add_argument("--limit", type=int, default=5, help="Limit for scores")
 
     args = parser.parse_args()
     inverted_index = InvertedIndex()
@@ -51,8 +72,33 @@ def main() -> None:
                     os._exit(1)
             search.search(args.query, inverted_index)
         case "build":
-            inverted_index.build()
+            inverted_index.build(workers=args.workers, positions=args.positions)
             inverted_index.save()
+        case "convert":
+            try:
+                cmd_convert_pickles()
+            except FileNotFoundError:
+                    print("Pickled index not found, nothing to convert.")
+        case "add":
+            try:
+                cmd_add_documents(args.path)
+            except FileNotFoundError:
+                    print("Index not found, please run the build command first.")
+        case "delete":
+            try:
+                cmd_delete_documents(args.doc_ids)
+            except FileNotFoundError:
+                    print("Index not found, please run the build command first.")
+        case "merge":
+            try:
+                cmd_merge_segments()
+            except FileNotFoundError:
+                    print("Index not found, please run the build command first.")
+        case "sync":
+            try:
+                cmd_sync_documents()
+            except FileNotFoundError:
+                    print("Index not found, please run the build command first.")
         case "tf":
             try:
                 inverted_index.load()
@@ -81,18 +127,32 @@ def main() -> None:
                     print("more terms than expected given expected: 1")
         case "bm25tf":
             try:
-                bm25tf = inverted_index.bm25_tf_command(args.doc_id, args.term)
+                bm25tf = inverted_index.bm25_tf_command(args.doc_id, args.term, args.k1, args.b)
                 print(f"BM25 TF score of '{args.term}' in document '{args.doc_id}': {bm25tf:.2f}")
             except ValueError:
                     print("more terms than expected given expected: 1")     
         case "bm25search":
             try:
                 inverted_index.load()
-                bm25_list = inverted_index.bm25_search(args.query, args.limit)
-                for i,(doc, score) in enumerate(bm25_list, start=1):
-                     print(f"{i}. {doc['title']} - Score {score:.2f}")
+                bm25_list = inverted_index.bm25_search(args.query, args.limit, args.exhaustive, args.k1, args.b)
+                for i, doc in enumerate(bm25_list, start=1):
+                     print(f"{i}. {doc['title']} - Score {doc['score']:.2f}")
             except ValueError:
                     print("more terms than expected given expected: 1")                 
+        case "phrase":
+            try:
+                inverted_index.load()
+                for i, doc in enumerate(inverted_index.phrase_search(args.query, args.limit), start=1):
+                     print(f"{i}. {doc['title']} - Score {doc['score']:.2f}")
+            except ValueError:
+                    print("Index has no word positions, please run the build command with --positions.")
+        case "near":
+            try:
+                inverted_index.load()
+                for i, doc in enumerate(inverted_index.proximity_search(args.query, args.distance, args.limit), start=1):
+                     print(f"{i}. {doc['title']} - Score {doc['score']:.2f}")
+            except ValueError:
+                    print("Index has no word positions, please run the build command with --positions.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
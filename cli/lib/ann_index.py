@@ -0,0 +1,99 @@
+import math
+import os
+import numpy as np
+from .semantic_search_util import IVF_ITERATIONS, IVF_TRAIN_SAMPLES_PER_LIST, normalize_rows
+from .top_k import top_k_indices
+from .quantization import QuantizedMatrix
+
+# rows scored per matrix product while assigning vectors to centroids, bounds the score buffer
+ASSIGN_BATCH_SIZE = 8192
+
+
+class IVFIndex:
+    # inverted file index over unit length rows: k-means centroids split the rows into lists and a query only
+    # scores the rows of the nprobe lists whose centroids are closest to it. The rows of list i are
+    # list_rows[list_offsets[i]:list_offsets[i + 1]]; only those are saved, the vectors are regrouped per
+    # list in memory so a probed list is scored from one contiguous block. The matrix can be a QuantizedMatrix,
+    # the lists then hold its codes and search returns approximate scores
+    def __init__(self, matrix, centroids, list_offsets, list_rows):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.list_vectors = matrix[list_rows]
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, iterations=IVF_ITERATIONS, seed=0):
+        if n_lists is None:
+            n_lists = default_list_count(len(matrix))
+        n_lists = max(1, min(n_lists, len(matrix)))
+        vectors = normalize_rows(matrix.decode()) if isinstance(matrix, QuantizedMatrix) else matrix
+        centroids = spherical_kmeans(vectors, n_lists, iterations, np.random.default_rng(seed))
+        assignments = assign_to_centroids(vectors, centroids)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        return cls(matrix, centroids, list_offsets, list_rows)
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def search(self, query, nprobe):
+        # rows of the probed lists in increasing order, with their dot product scores against the query
+        probed = top_k_indices(self.centroids @ query, nprobe).tolist()
+        bounds = [(self.list_offsets[i], self.list_offsets[i + 1]) for i in probed]
+        rows = np.concatenate([self.list_rows[start:end] for start, end in bounds])
+        scores = np.concatenate([self.list_vectors[start:end] @ query for start, end in bounds])
+        order = np.argsort(rows)
+        return rows[order], scores[order]
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, matrix):
+        with np.load(path) as arrays:
+            return cls(matrix, arrays["centroids"], arrays["list_offsets"], arrays["list_rows"])
+
+    @classmethod
+    def load_or_build(cls, path, matrix):
+        # an index for a different set of rows is rebuilt; rebuilt embeddings always rebuild their index
+        if os.path.exists(path):
+            index = cls.load(path, matrix)
+            if len(index.list_rows) == len(matrix) and index.centroids.shape[1:] == matrix.shape[1:]:
+                return index
+        index = cls.build(matrix)
+        index.save(path)
+        return index
+
+
+def default_list_count(row_count):
+    return max(1, round(math.sqrt(row_count)))
+
+
+def assign_to_centroids(matrix, centroids):
+    assignments = np.zeros(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), ASSIGN_BATCH_SIZE):
+        assignments[start:start + ASSIGN_BATCH_SIZE] = np.argmax(matrix[start:start + ASSIGN_BATCH_SIZE] @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(matrix, n_lists, iterations, rng):
+    # k-means on cosine similarity over a sample of the rows; centroids are renormalized every round and
+    # a list left empty is reseeded with a random row
+    sample_size = min(len(matrix), n_lists * IVF_TRAIN_SAMPLES_PER_LIST)
+    sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
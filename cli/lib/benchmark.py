@@ -0,0 +1,436 @@
+import os
+import pickle
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+import numpy as np
+from .search_utils import load_movies, tokenization
+from .evaluation_util import load_golden_set
+from .inverted_index import InvertedIndex
+from .index_segment import IndexSegment
+from .top_k import top_k_indices
+from .ann_index import IVFIndex
+from .quantization import quantize, rescore
+from .semantic_search_util import CHUNK_EMBEDDINGS, RESCORE_CANDIDATES_PER_RESULT, normalize_rows
+from .hybrid_search import HybridSearch, shared_leg_executor
+from .result_cache import SearchResultCache
+
+DEFAULT_CORPUS_SIZES = [250, 500, 1000, 2000]
+DEFAULT_UPDATE_SIZES = [1, 10, 100]
+DEFAULT_SWEEP_K1 = [0.9, 1.2, 1.5, 1.8, 2.1]
+DEFAULT_SWEEP_B = [0.3, 0.5, 0.75, 0.9]
+DEFAULT_SELECTION_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_NPROBES = [1, 2, 4, 8, 16, 32]
+DEFAULT_BATCH_SIZES = [1, 8, 32, 128]
+CLI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules a command should only import when it uses them
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "google.genai", "PIL", "nltk"]
+DEFAULT_STARTUP_COMMANDS = [
+    "hybrid_search_cli.py --help",
+    "hybrid_search_cli.py normalize 0.5 1.0 2.0",
+    "hybrid_search_cli.py weighted-search 'space adventure'",
+    "semantic_search_cli.py --help",
+    "semantic_search_cli.py semantic_chunk 'One sentence. Another one.'",
+    "semantic_search_cli.py search_chunked 'space adventure'",
+    "keyword_search_cli.py --help",
+    "keyword_search_cli.py search 'space adventure'",
+    "augmented_generation_cli.py --help",
+    "evaluation_cli.py --help",
+    "multimodal_search_cli.py --help",
+    "describe_image_cli.py --help",
+    "search_server_cli.py status",
+]
+
+
+def time_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def benchmark_queries() -> list[str]:
+    return [test_case["query"] for test_case in load_golden_set()]
+
+
+def legacy_bm25_scan(index: InvertedIndex, query, limit) -> list[tuple]:
+    # the scoring loop bm25_search used before postings-based scoring
+    tokens = tokenization(query)
+    scores = {}
+    for doc_id in index.docmap:
+        for token in tokens:
+            if doc_id not in scores:
+                scores[doc_id] = index.bm25(doc_id, token)
+            else:
+                scores[doc_id] += index.bm25(doc_id, token)
+    scores_sorted = sorted(scores.items(), key=lambda score: score[1], reverse=True)
+    return scores_sorted[:limit]
+
+
+def cmd_bench_bm25(sizes, limit, repeat):
+    movies = load_movies()["movies"]
+    queries = benchmark_queries()
+    print(f"{'docs':>8} {'scan ms':>10} {'postings ms':>12} {'speedup':>8}  same")
+    for size in sizes:
+        documents = movies[:size]
+        index = InvertedIndex()
+        index.build(documents)
+
+        scan_total, postings_total, same = 0.0, 0.0, True
+        for query in queries:
+            scan_time, scan_results = time_call(lambda: legacy_bm25_scan(index, query, limit), repeat)
+            postings_time, postings_results = time_call(lambda: index.bm25_search(query, limit), repeat)
+            scan_total += scan_time
+            postings_total += postings_time
+            postings_pairs = [(result["id"], result["score"]) for result in postings_results]
+            same = same and postings_pairs == scan_results
+
+        scan_ms = scan_total / len(queries) * 1000
+        postings_ms = postings_total / len(queries) * 1000
+        print(f"{len(documents):>8} {scan_ms:>10.3f} {postings_ms:>12.3f} {scan_ms / postings_ms:>7.1f}x  {same}")
+
+
+def write_pickle_index(index: InvertedIndex, path):
+    # the four pickles the index was saved as before the memory-mapped format
+    segment = index.reader.segments[0]
+    docmap = {}
+    term_frequencies = {}
+    doc_lengths = {}
+    inverted = {}
+    for row, doc_id in enumerate(segment.doc_ids.tolist()):
+        docmap[doc_id] = segment.document(row)
+        term_frequencies[doc_id] = Counter()
+        doc_lengths[doc_id] = int(segment.doc_lengths[row])
+    for term_id in range(len(segment.terms)):
+        term = segment.terms[term_id]
+        docs, tfs = segment.postings(term)
+        inverted[term] = set()
+        for row, tf in zip(docs.tolist(), tfs.tolist()):
+            doc_id = int(segment.doc_ids[row])
+            inverted[term].add(doc_id)
+            term_frequencies[doc_id][term] = tf
+    for name, value in (("index", inverted), ("docmap", docmap), ("term_frequencies", term_frequencies), ("doc_lengths", doc_lengths)):
+        with open(os.path.join(path, f"{name}.pkl"), "wb") as f:
+            pickle.dump(value, f)
+
+
+def load_pickle_index(path):
+    loaded = []
+    for name in ("index", "docmap", "term_frequencies", "doc_lengths"):
+        with open(os.path.join(path, f"{name}.pkl"), "rb") as f:
+            loaded.append(pickle.load(f))
+    return loaded
+
+
+def cmd_bench_index_load(sizes, repeat):
+    movies = load_movies()["movies"]
+    print(f"{'docs':>8} {'pickle ms':>10} {'mmap ms':>10} {'speedup':>8}")
+    for size in sizes:
+        index = InvertedIndex()
+        index.build(movies[:size])
+        with tempfile.TemporaryDirectory() as path:
+            write_pickle_index(index, path)
+            segment_path = os.path.join(path, "keyword_index")
+            index.reader.segments[0].save(segment_path)
+            pickle_time, _ = time_call(lambda: load_pickle_index(path), repeat)
+            mmap_time, _ = time_call(lambda: IndexSegment.load(segment_path), repeat)
+        print(f"{len(index.reader):>8} {pickle_time * 1000:>10.3f} {mmap_time * 1000:>10.3f} {pickle_time / mmap_time:>7.1f}x")
+
+
+def cmd_bench_bm25_top_k(sizes, limit, repeat):
+    movies = load_movies()["movies"]
+    queries = benchmark_queries()
+    print(f"{'docs':>8} {'exhaustive ms':>14} {'maxscore ms':>12} {'speedup':>8}  same")
+    for size in sizes:
+        index = InvertedIndex()
+        index.build(movies[:size])
+
+        exhaustive_total, pruned_total, same = 0.0, 0.0, True
+        for query in queries:
+            exhaustive_time, exhaustive_results = time_call(lambda: index.bm25_search(query, limit, exhaustive=True), repeat)
+            pruned_time, pruned_results = time_call(lambda: index.bm25_search(query, limit), repeat)
+            exhaustive_total += exhaustive_time
+            pruned_total += pruned_time
+            same = same and exhaustive_results == pruned_results
+
+        exhaustive_ms = exhaustive_total / len(queries) * 1000
+        pruned_ms = pruned_total / len(queries) * 1000
+        print(f"{len(index.reader):>8} {exhaustive_ms:>14.3f} {pruned_ms:>12.3f} {exhaustive_ms / pruned_ms:>7.1f}x  {same}")
+
+
+def segments_equal(a: IndexSegment, b: IndexSegment) -> bool:
+    arrays = ("postings_offsets", "postings_docs", "postings_tfs", "max_tfs", "min_lengths", "doc_ids", "doc_order", "doc_lengths")
+    if any(not np.array_equal(getattr(a, name), getattr(b, name)) for name in arrays):
+        return False
+    return a.terms.blob == b.terms.blob and a.documents.blob == b.documents.blob and a.total_length == b.total_length
+
+
+def cmd_bench_build(workers_list, repeat):
+    movies = load_movies()["movies"]
+    serial = InvertedIndex()
+    serial_time, _ = time_call(lambda: serial.build(movies), repeat)
+    print(f"{'workers':>8} {'build s':>10} {'speedup':>8}  identical")
+    print(f"{1:>8} {serial_time:>10.3f} {1.0:>7.1f}x  True")
+    for workers in workers_list:
+        if workers <= 1:
+            continue
+        index = InvertedIndex()
+        build_time, _ = time_call(lambda: index.build(movies, workers=workers), repeat)
+        print(f"{workers:>8} {build_time:>10.3f} {serial_time / build_time:>7.1f}x  {segments_equal(serial.reader.segments[0], index.reader.segments[0])}")
+
+
+def cmd_bench_update(update_sizes, repeat):
+    movies = load_movies()["movies"]
+    with tempfile.TemporaryDirectory() as path:
+        index = InvertedIndex(path)
+        rebuild_time, _ = time_call(lambda: (index.build(movies), index.save()), repeat)
+        print(f"{'changed':>8} {'update ms':>10} {'rebuild ms':>11} {'speedup':>8}  same")
+        for size in update_sizes:
+            edited = [{**movie, "description": f"{movie['description']} sequel"} for movie in movies[:size]]
+            update_time, _ = time_call(lambda: index.update_documents(edited), repeat)
+            catalog = {movie["id"]: movie for movie in movies} | {movie["id"]: movie for movie in edited}
+            rebuilt = InvertedIndex()
+            rebuilt.build(list(catalog.values()))
+            same = all(
+                sorted((r["id"], r["score"]) for r in index.bm25_search(query, len(movies), exhaustive=True))
+                == sorted((r["id"], r["score"]) for r in rebuilt.bm25_search(query, len(movies), exhaustive=True))
+                for query in benchmark_queries()
+            )
+            print(f"{size:>8} {update_time * 1000:>10.3f} {rebuild_time * 1000:>11.3f} {rebuild_time / update_time:>7.1f}x  {same}")
+            index.build(movies)
+            index.save()
+
+
+def cmd_bench_bm25_sweep(k1_values, b_values, limit):
+    # precision/recall of plain BM25 on the golden set for every (k1, b), against the saved index
+    index = InvertedIndex()
+    index.load()
+    test_cases = load_golden_set()
+    start = time.perf_counter()
+    rows = []
+    for k1 in k1_values:
+        for b in b_values:
+            precision_total, recall_total = 0.0, 0.0
+            for test_case in test_cases:
+                titles = [result["title"] for result in index.bm25_search(test_case["query"], limit, exhaustive=True, k1=k1, b=b)]
+                relevant_retrieved_count = sum(title in test_case["relevant_docs"] for title in titles)
+                precision_total += relevant_retrieved_count / len(titles) if titles else 0.0
+                recall_total += relevant_retrieved_count / len(test_case["relevant_docs"])
+            precision = precision_total / len(test_cases)
+            recall = recall_total / len(test_cases)
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            rows.append((k1, b, precision, recall, f1))
+    elapsed = time.perf_counter() - start
+
+    best = max(rows, key=lambda row: row[4])
+    print(f"{'k1':>6} {'b':>6} {'P@' + str(limit):>8} {'R@' + str(limit):>8} {'F1':>8}")
+    for row in rows:
+        marker = "  best" if row is best else ""
+        print(f"{row[0]:>6.2f} {row[1]:>6.2f} {row[2]:>8.4f} {row[3]:>8.4f} {row[4]:>8.4f}{marker}")
+    print(f"{len(rows)} settings x {len(test_cases)} queries in {elapsed:.2f}s")
+
+
+def cmd_bench_phrase(limit, repeat):
+    # golden queries and movie titles as quoted phrases, against BM25 over the same words
+    movies = load_movies()["movies"]
+    index = InvertedIndex()
+    index.build(movies, positions=True)
+    positional = index.reader.segments[0]
+    print(f"positions: {positional.positions.nbytes + positional.positions_offsets.nbytes} bytes ({positional.positions.dtype}) for {len(positional.postings_docs)} postings")
+    phrases = {"golden queries": benchmark_queries(), "titles": [movie["title"] for movie in movies[:200]]}
+    print(f"{'phrases':>15} {'bm25 ms':>10} {'phrase ms':>10} {'bm25 hits':>10} {'phrase hits':>12}")
+    for name, queries in phrases.items():
+        bm25_total, phrase_total, bm25_hits, phrase_hits = 0.0, 0.0, 0, 0
+        for query in queries:
+            bm25_time, bm25_results = time_call(lambda: index.bm25_search(query, limit), repeat)
+            phrase_time, phrase_results = time_call(lambda: index.phrase_search(query, limit), repeat)
+            bm25_total += bm25_time
+            phrase_total += phrase_time
+            bm25_hits += len(bm25_results)
+            phrase_hits += len(phrase_results)
+        print(f"{name:>15} {bm25_total / len(queries) * 1000:>10.3f} {phrase_total / len(queries) * 1000:>10.3f} {bm25_hits:>10} {phrase_hits:>12}")
+
+
+def cmd_bench_resident(limit, repeat):
+    # per query cost of reloading the saved index, as HybridSearch used to, against revalidating it
+    index = InvertedIndex()
+    index.load()
+    queries = benchmark_queries()
+    reload_total, resident_total = 0.0, 0.0
+    for query in queries:
+        reload_time, _ = time_call(lambda: (index.load(), index.bm25_search(query, limit)), repeat)
+        resident_time, _ = time_call(lambda: (index.refresh(), index.bm25_search(query, limit)), repeat)
+        reload_total += reload_time
+        resident_total += resident_time
+    reload_ms = reload_total / len(queries) * 1000
+    resident_ms = resident_total / len(queries) * 1000
+    print(f"{'docs':>8} {'reload ms':>10} {'resident ms':>12} {'speedup':>8}")
+    print(f"{len(index.reader):>8} {reload_ms:>10.3f} {resident_ms:>12.3f} {reload_ms / resident_ms:>7.1f}x")
+
+
+def cmd_bench_top_k(sizes, limit, repeat):
+    # sorting every score, as the retrievers did, against selecting the top k
+    rng = np.random.default_rng(0)
+    print(f"{'scores':>10} {'sort ms':>10} {'top-k ms':>10} {'speedup':>8}  same")
+    for size in sizes:
+        scores = rng.random(size, dtype=np.float32)
+        sort_time, sorted_top = time_call(lambda: sorted(range(size), key=lambda i: scores[i], reverse=True)[:limit], repeat)
+        top_k_time, top = time_call(lambda: top_k_indices(scores, limit), repeat)
+        print(f"{size:>10} {sort_time * 1000:>10.3f} {top_k_time * 1000:>10.3f} {sort_time / top_k_time:>7.1f}x  {top.tolist() == sorted_top}")
+
+
+def cmd_bench_ann(nprobes, limit, query_count):
+    # chunk embeddings themselves serve as queries, so the benchmark runs without loading the model
+    if not os.path.exists(CHUNK_EMBEDDINGS):
+        print("Chunk embeddings not found, please run the embed_chunks command first.")
+        return
+    matrix = normalize_rows(np.load(CHUNK_EMBEDDINGS))
+    build_time, index = time_call(lambda: IVFIndex.build(matrix), 1)
+    print(f"{len(matrix)} chunks, {len(index)} lists, built in {build_time:.2f}s")
+    queries = matrix[np.random.default_rng(0).choice(len(matrix), min(query_count, len(matrix)), replace=False)]
+
+    exhaustive_total = 0.0
+    exact = []
+    for query in queries:
+        exhaustive_time, top = time_call(lambda: top_k_indices(matrix @ query, limit), 1)
+        exhaustive_total += exhaustive_time
+        exact.append(set(top.tolist()))
+    print(f"{'nprobe':>8} {'ms':>8} {'speedup':>8} {'recall@' + str(limit):>10}")
+    print(f"{'all':>8} {exhaustive_total / len(queries) * 1000:>8.3f} {1.0:>7.1f}x {1.0:>10.4f}")
+    for nprobe in nprobes:
+        ann_total, found = 0.0, 0
+        for query, exact_top in zip(queries, exact):
+            def search():
+                rows, scores = index.search(query, nprobe)
+                return rows[top_k_indices(scores, limit)]
+            ann_time, top = time_call(search, 1)
+            ann_total += ann_time
+            found += len(exact_top & set(top.tolist()))
+        recall = found / sum(len(exact_top) for exact_top in exact)
+        print(f"{nprobe:>8} {ann_total / len(queries) * 1000:>8.3f} {exhaustive_total / ann_total:>7.1f}x {recall:>10.4f}")
+
+
+def cmd_bench_quantization(kinds, limit, query_count):
+    # memory, latency and recall@limit of every quantization against exhaustive float32 search, before and
+    # after rescoring RESCORE_CANDIDATES_PER_RESULT * limit candidates at full precision
+    if not os.path.exists(CHUNK_EMBEDDINGS):
+        print("Chunk embeddings not found, please run the embed_chunks command first.")
+        return
+    embeddings = np.load(CHUNK_EMBEDDINGS, mmap_mode="r")
+    matrix = normalize_rows(embeddings)
+    queries = matrix[np.random.default_rng(0).choice(len(matrix), min(query_count, len(matrix)), replace=False)]
+    rows = np.arange(len(matrix))
+    exhaustive_time, exact = time_call(lambda: [set(top_k_indices(matrix @ query, limit).tolist()) for query in queries], 1)
+    total = sum(len(exact_top) for exact_top in exact)
+    print(f"{len(matrix)} chunks, {len(queries)} queries, {limit * RESCORE_CANDIDATES_PER_RESULT} candidates rescored")
+    print(f"{'storage':>8} {'MB':>8} {'ratio':>7} {'encode s':>9} {'ms':>8} {'recall@' + str(limit):>10} {'rescored ms':>12} {'recall@' + str(limit):>10}")
+    print(f"{'float32':>8} {matrix.nbytes / 1e6:>8.2f} {1.0:>6.1f}x {'':>9} {exhaustive_time / len(queries) * 1000:>8.3f} {1.0:>10.4f} {'':>12} {'':>10}")
+    for kind in kinds:
+        encode_time, quantized = time_call(lambda: quantize(kind, embeddings), 1)
+
+        def approximate():
+            return [top_k_indices(quantized @ query, limit) for query in queries]
+
+        def rescored():
+            tops = []
+            for query in queries:
+                candidates, scores = rescore(embeddings, query, rows, quantized @ query, limit * RESCORE_CANDIDATES_PER_RESULT)
+                tops.append(candidates[top_k_indices(scores, limit)])
+            return tops
+        approximate_time, approximate_tops = time_call(approximate, 1)
+        rescored_time, rescored_tops = time_call(rescored, 1)
+        approximate_recall = sum(len(exact_top & set(top.tolist())) for exact_top, top in zip(exact, approximate_tops)) / total
+        rescored_recall = sum(len(exact_top & set(top.tolist())) for exact_top, top in zip(exact, rescored_tops)) / total
+        print(f"{kind:>8} {quantized.nbytes / 1e6:>8.2f} {matrix.nbytes / quantized.nbytes:>6.1f}x {encode_time:>9.2f} "
+              f"{approximate_time / len(queries) * 1000:>8.3f} {approximate_recall:>10.4f} {rescored_time / len(queries) * 1000:>12.3f} {rescored_recall:>10.4f}")
+
+
+def cmd_bench_batch_scoring(batch_sizes, limit, repeat):
+    # per query cost of scoring every chunk one query at a time against one matrix product per batch;
+    # chunk embeddings serve as queries so the model is not needed
+    if not os.path.exists(CHUNK_EMBEDDINGS):
+        print("Chunk embeddings not found, please run the embed_chunks command first.")
+        return
+    matrix = normalize_rows(np.load(CHUNK_EMBEDDINGS))
+    rng = np.random.default_rng(0)
+    print(f"{len(matrix)} chunks")
+    print(f"{'batch':>8} {'loop ms/query':>14} {'batched ms/query':>17} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        queries = matrix[rng.choice(len(matrix), batch_size, replace=len(matrix) < batch_size)]
+        loop_time, _ = time_call(lambda: [top_k_indices(matrix @ query, limit) for query in queries], repeat)
+        batched_time, _ = time_call(lambda: [top_k_indices(scores, limit) for scores in queries @ matrix.T], repeat)
+        print(f"{batch_size:>8} {loop_time / batch_size * 1000:>14.3f} {batched_time / batch_size * 1000:>17.3f} {loop_time / batched_time:>7.1f}x")
+
+
+def cmd_bench_hybrid_legs(workers, limit, repeat):
+    # per query latency of rrf_search with its legs run one after the other and on the leg pool. A warm-up
+    # pass fills the query embedding cache first, so both runs score the same warm queries. A result cache
+    # that keeps nothing makes every run search
+    hybrid_search = HybridSearch(load_movies()["movies"])
+    hybrid_search.result_cache = SearchResultCache(capacity=0)
+    queries = benchmark_queries()
+    for query in queries:
+        hybrid_search.rrf_search(query, 60, limit)
+    print(f"{len(queries)} queries x {repeat}")
+    print(f"{'legs':>12} {'p50 ms':>8} {'p99 ms':>8} {'bm25 p50':>9} {'semantic p50':>13}")
+    for name, executor in (("sequential", None), (f"{workers} threads", shared_leg_executor(workers))):
+        hybrid_search.leg_executor = executor
+        latencies, timings = [], []
+        for _ in range(repeat):
+            for query in queries:
+                latency, (_, query_timings) = time_call(lambda: hybrid_search.rrf_search_many_with_timings([query], 60, limit), 1)
+                latencies.append(latency * 1000)
+                timings.append(query_timings[0])
+        bm25_ms = np.median([timing.get("bm25_ms", 0.0) for timing in timings])
+        semantic_ms = np.median([timing.get("semantic_ms", 0.0) for timing in timings])
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{name:>12} {p50:>8.3f} {p99:>8.3f} {bm25_ms:>9.3f} {semantic_ms:>13.3f}")
+
+
+def imported_modules(args) -> set[str]:
+    # names of every module a run of args imports, from the -X importtime report on stderr
+    completed = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=CLI_DIR, capture_output=True, text=True)
+    return {line.rsplit("|", 1)[1].strip() for line in completed.stderr.splitlines() if line.startswith("import time:")}
+
+
+def cmd_bench_startup(commands, repeat):
+    # wall time of whole CLI runs, each a fresh interpreter, and the heavy modules each one imports; a command
+    # that pulls in a module it does not use shows up here
+    width = max(len(command) for command in commands)
+    print(f"{'command':<{width}} {'median ms':>10} {'min ms':>8} {'exit':>5}  heavy imports")
+    for command in commands:
+        args = shlex.split(command)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, *args], cwd=CLI_DIR, capture_output=True)
+            times.append((time.perf_counter() - start) * 1000)
+        modules = imported_modules(args)
+        heavy = [module for module in HEAVY_MODULES if module in modules]
+        print(f"{command:<{width}} {np.median(times):>10.1f} {min(times):>8.1f} {completed.returncode:>5}  {', '.join(heavy) or '-'}")
+
+
+def cmd_bench_result_cache(limit, repeat):
+    # per query latency of rrf_search over the golden queries with an empty result cache, then from the memory
+    # tier, then from the disk tier of a new HybridSearch as a later CLI run would see it
+    movies = load_movies()["movies"]
+    queries = benchmark_queries()
+    hybrid_search = HybridSearch(movies)
+    hybrid_search.result_cache.clear()
+    cold_time, cold = time_call(lambda: [hybrid_search.rrf_search(query, 60, limit) for query in queries], 1)
+    memory_time, memory = time_call(lambda: [hybrid_search.rrf_search(query, 60, limit) for query in queries], repeat)
+    later_search = HybridSearch(movies)
+    disk_time, disk = time_call(lambda: [later_search.rrf_search(query, 60, limit) for query in queries], 1)
+
+    def ranking(all_results):
+        return [[(result["id"], result["rrf_score"]) for result in results] for results in all_results]
+    print(f"{len(queries)} queries, version {hybrid_search.version}")
+    print(f"{'results':>8} {'ms/query':>10} {'speedup':>8}  same")
+    print(f"{'searched':>8} {cold_time / len(queries) * 1000:>10.3f} {1.0:>7.1f}x  {True}")
+    print(f"{'memory':>8} {memory_time / len(queries) * 1000:>10.3f} {cold_time / memory_time:>7.1f}x  {ranking(memory) == ranking(cold)}")
+    print(f"{'disk':>8} {disk_time / len(queries) * 1000:>10.3f} {cold_time / disk_time:>7.1f}x  {ranking(disk) == ranking(cold)}")
+    cache = hybrid_search.result_cache
+    print(f"hits {cache.hits}, disk hits {later_search.result_cache.disk_hits}, misses {cache.misses}")
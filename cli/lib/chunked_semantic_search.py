@@ -1,38 +1,42 @@
-from lib.semantic_search import SemanticSearch, cmd_sematic_chunk, cosine_similarity
-from lib.semantic_search_util import CHUNK_METADATA, CHUNK_EMBEDDINGS, file_exist, load_movies
+from lib.semantic_search import SemanticSearch, cmd_sematic_chunk
+from lib.semantic_search_util import keys_path, CHUNK_METADATA, CHUNK_DOCUMENT_KEYS, CHUNK_MOVIE_IDX, CHUNK_IDX, CHUNK_EMBEDDINGS, CHUNK_IVF_INDEX, IVF_NPROBE, CHUNK_POOLING, CHUNK_POOLING_MODES, CHUNK_POOLING_TOP_N, EMBEDDING_QUANTIZATION, EMBED_WORKERS, RESCORE_CANDIDATES_PER_RESULT, file_exist, load_movies, content_key, content_keys, normalize_rows, save_array
+from lib.ann_index import IVFIndex
+from lib.quantization import rescore
+from lib.search_client import SearchClient
+from lib.top_k import top_k_indices
+from array import array
 import numpy as np 
-import json as json
+import hashlib
+import os
 
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name = "all-MiniLM-L6-v2", quantization=EMBEDDING_QUANTIZATION, encode_workers=EMBED_WORKERS) -> None:
+        super().__init__(model_name, quantization, encode_workers)
         self.chunk_embeddings = None
+        self.chunk_matrix = None
         self.chunk_metadata = None
+        self.ann_index = None
+        self.version = None
 
     def build_chunk_embeddings(self, documents):
+        # two passes over the chunks: the first keeps only their metadata and content keys, the second
+        # streams the texts to be encoded, so no list of every chunk is held in memory
         self.documents = documents
-        all_chunks = []
-        chunk_metadata = []
-
-        for i, doc in enumerate(documents):
-            movie_desc = doc['description']
-            if len(movie_desc) == 0:
-                continue
-            chunks = cmd_sematic_chunk(movie_desc, 4, 1)
-            for j, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                chunk_metadata.append({
-                    "movie_idx": i,
-                    "chunk_idx": j,
-                    "total_chunks": len(chunks)
-                })
+        movie_idxs, chunk_idxs, total_chunks, keys = array("i"), array("i"), array("i"), array("Q")
+
+        for movie_idx, chunk_idx, chunk_count, chunk in iter_chunks(documents):
+            movie_idxs.append(movie_idx)
+            chunk_idxs.append(chunk_idx)
+            total_chunks.append(chunk_count)
+            keys.append(content_key(chunk, self.model_name))
 
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_metadata
-        np.save(CHUNK_EMBEDDINGS, self.chunk_embeddings)
-        with open(CHUNK_METADATA, "w") as f:
-            json.dump({"chunks": chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2)
+        if file_exist(CHUNK_DOCUMENT_KEYS):
+            os.remove(CHUNK_DOCUMENT_KEYS)
+        changed = self.encode_cached(np.frombuffer(keys, dtype=np.uint64), (chunk for *_, chunk in iter_chunks(documents)), CHUNK_EMBEDDINGS)
+        save_array(CHUNK_METADATA, np.stack([np.frombuffer(column, dtype=np.int32) for column in (movie_idxs, chunk_idxs, total_chunks)]))
+        self.__open_chunks(rebuild_index=changed)
+        save_array(CHUNK_DOCUMENT_KEYS, self.__document_keys(documents))
         return self.chunk_embeddings
     
     def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
@@ -40,64 +44,143 @@ class ChunkedSemanticSearch(SemanticSearch):
         for doc in documents:
             self.document_map[doc['id']] = doc
 
-        if file_exist(CHUNK_EMBEDDINGS) and file_exist(CHUNK_METADATA):
-            self.chunk_embeddings = np.load(CHUNK_EMBEDDINGS)
-            with open(CHUNK_METADATA, "r") as f:
-                meta = json.load(f)
-                self.chunk_metadata = meta["chunks"]
-
+        # unchanged descriptions skip chunking, otherwise only new or edited chunks are encoded
+        if file_exist(CHUNK_EMBEDDINGS) and file_exist(CHUNK_METADATA) and file_exist(CHUNK_DOCUMENT_KEYS) and np.array_equal(np.load(CHUNK_DOCUMENT_KEYS), self.__document_keys(documents)):
+            self.__open_chunks(rebuild_index=False)
             return self.chunk_embeddings
         return self.build_chunk_embeddings(documents)
+
+    def __open_chunks(self, rebuild_index):
+        self.chunk_embeddings, self.chunk_matrix, self.quantized = self.open_embeddings(CHUNK_EMBEDDINGS)
+        self.chunk_metadata = np.load(CHUNK_METADATA, mmap_mode="r").view(np.ndarray)
+        # identifies what is searched: the content of every chunk row, the movie each row belongs to and the
+        # quantization, so rebuilt embeddings get a new version unless nothing in them changed
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(np.load(keys_path(CHUNK_EMBEDDINGS)).tobytes())
+        digest.update(self.chunk_metadata.tobytes())
+        digest.update(str(self.quantization).encode())
+        self.version = digest.hexdigest()
+        # the ANN index is opened by the first search that probes it, an index of the previous rows is stale
+        self.ann_index = None
+        if rebuild_index and file_exist(CHUNK_IVF_INDEX):
+            os.remove(CHUNK_IVF_INDEX)
+
+    def __document_keys(self, documents):
+        return content_keys([doc["description"] for doc in documents], self.model_name)
     
-    def search_chunks(self, query: str, limit: int = 10):
-        query_embedding = self.generate_embedding(query)
-        chunk_scores = []
-
-        for i, chunk_embedding in enumerate(self.chunk_embeddings) :
-            cosine_score = cosine_similarity(query_embedding, chunk_embedding)
-            chunk_scores.append({
-                "chunk_idx": self.chunk_metadata[i]["chunk_idx"],
-                "movie_idx": self.chunk_metadata[i]["movie_idx"],
-                "score": cosine_score
-            })
-        idx_to_scores = {}
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            if movie_idx not in idx_to_scores:
-                idx_to_scores[movie_idx] = chunk_score
-            elif chunk_score["score"] > idx_to_scores[movie_idx]["score"]:
-               idx_to_scores[movie_idx] = chunk_score
-
-        best_chunk_scores = list(idx_to_scores.values())
-        best_chunk_scores.sort(key=lambda cs: cs["score"], reverse=True)
-        top_chunk_scores = best_chunk_scores[:limit]
-
-        results =[]
-        for chunk_score in top_chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            doc = self.documents[movie_idx]
-            results.append({
-                "id": doc["id"],
-                "title": doc["title"],
-                "document": doc["description"][:100],
-                "score": chunk_score["score"],
-                "metadata": doc.get("metadata") or {}
-            })
+    def search_chunks(self, query: str, limit: int = 10, nprobe: int = IVF_NPROBE, pooling: str = CHUNK_POOLING, top_n: int = CHUNK_POOLING_TOP_N):
+        return self.search_chunks_many([query], limit, nprobe, pooling, top_n)[0]
+
+    def search_chunks_many(self, queries, limit: int = 10, nprobe: int = IVF_NPROBE, pooling: str = CHUNK_POOLING, top_n: int = CHUNK_POOLING_TOP_N):
+        results = []
+        for movie_idxs, scores, chunk_idxs in self.rank_chunks_many(queries, limit, nprobe, pooling, top_n):
+            query_results = []
+            for movie_idx, score, chunk_idx in zip(movie_idxs.tolist(), scores, chunk_idxs.tolist()):
+                doc = self.documents[movie_idx]
+                query_results.append({
+                    "id": doc["id"],
+                    "title": doc["title"],
+                    "document": doc["description"][:100],
+                    "score": score,
+                    "chunk_idx": chunk_idx,
+                    "metadata": doc.get("metadata") or {}
+                })
+            results.append(query_results)
         return results
 
+    def rank_chunks_many(self, queries, limit: int = 10, nprobe: int = IVF_NPROBE, pooling: str = CHUNK_POOLING, top_n: int = CHUNK_POOLING_TOP_N):
+        # nprobe inverted lists of the ANN index are scanned, 0 or a probe of every list scores all chunks.
+        # Quantized scores are approximate, the best of them are rescored at full precision. A movie scores the
+        # pooling of its chunk scores and reports its best chunk. Queries are encoded in one model call and an
+        # unquantized exhaustive search scores them in one matrix product. Returns per query the ranked
+        # arrays of movie indexes, their scores and their best chunk
+        if len(queries) == 0:
+            return []
+        query_matrix = normalize_rows(self.generate_embeddings(queries))
+        exhaustive = nprobe <= 0 or nprobe >= len(self.__ann_index())
+        all_rows = np.arange(self.chunk_metadata.shape[1], dtype=np.int64)
+        if exhaustive and self.quantized is None:
+            score_matrix = query_matrix @ self.chunk_matrix.T
 
-def cmd_search_chunked(query, limit,):
-    movies = load_movies()
-    chunked_semantic_search = ChunkedSemanticSearch()
-    chunked_semantic_search.load_or_create_chunk_embeddings(movies['movies'])
-    results = chunked_semantic_search.search_chunks(query, limit)
+        rankings = []
+        for j, query_embedding in enumerate(query_matrix):
+            if exhaustive and self.quantized is None:
+                rows, scores = all_rows, score_matrix[j]
+            elif exhaustive:
+                rows, scores = all_rows, self.quantized @ query_embedding
+            else:
+                rows, scores = self.ann_index.search(query_embedding, nprobe)
+            if self.quantized is not None:
+                rows, scores = rescore(self.chunk_embeddings, query_embedding, rows, scores, limit * RESCORE_CANDIDATES_PER_RESULT)
+            movie_idxs, pooled, best_rows = pool_chunk_scores(self.chunk_metadata[CHUNK_MOVIE_IDX][rows], scores, pooling, top_n)
+            top = top_k_indices(pooled, limit)
+            rankings.append((movie_idxs[top].astype(np.int64), pooled[top], self.chunk_metadata[CHUNK_IDX][rows[best_rows[top]]]))
+        return rankings
+
+    def __ann_index(self):
+        # its lists hold a regrouped copy of the chunk vectors in private memory, so only a search with
+        # nprobe > 0 pays for it; exhaustive search reads the memory-mapped rows shared by every process
+        if self.ann_index is None:
+            self.ann_index = IVFIndex.load_or_build(CHUNK_IVF_INDEX, self.__chunk_vectors())
+        return self.ann_index
+
+    def __chunk_vectors(self):
+        return self.chunk_matrix if self.quantized is None else self.quantized
+
+
+def iter_chunks(documents):
+    # (movie_idx, chunk_idx, total_chunks, text) of every chunk in row order
+    for i, doc in enumerate(documents):
+        movie_desc = doc['description']
+        if len(movie_desc) == 0:
+            continue
+        chunks = cmd_sematic_chunk(movie_desc, 4, 1)
+        for j, chunk in enumerate(chunks):
+            yield i, j, len(chunks), chunk
+
+
+def pool_chunk_scores(movie_idxs, scores, pooling, top_n):
+    # movie_idxs of the scored chunks never decrease, chunk rows are scored in increasing order and a movie's
+    # chunks are consecutive rows, so every movie is one segment. Returns each movie, its pooled score and the
+    # position of its best chunk, the first one on ties
+    if pooling not in CHUNK_POOLING_MODES:
+        raise ValueError(f"unknown pooling {pooling}, expected one of {', '.join(CHUNK_POOLING_MODES)}")
+    scores = np.asarray(scores)
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64), scores, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], movie_idxs[1:] != movie_idxs[:-1])))
+    counts = np.diff(np.append(starts, len(scores)))
+    best = np.maximum.reduceat(scores, starts)
+    positions = np.arange(len(scores))
+    best_rows = np.minimum.reduceat(np.where(scores == np.repeat(best, counts), positions, len(scores)), starts)
+    if pooling == "max":
+        pooled = best
+    elif pooling == "mean":
+        pooled = (np.add.reduceat(scores, starts) / counts).astype(scores.dtype)
+    else:
+        # sum of the top_n scores of every segment: rank chunks within their segment by descending score
+        segments = np.repeat(np.arange(len(starts)), counts)
+        order = np.lexsort((-scores, segments))
+        kept = order[positions - np.repeat(starts, counts) < top_n]
+        pooled = np.bincount(segments[kept], weights=scores[kept], minlength=len(starts)).astype(scores.dtype)
+    return movie_idxs[starts], pooled, best_rows
+
+
+def cmd_search_chunked(query, limit, nprobe=IVF_NPROBE, quantization=EMBEDDING_QUANTIZATION, pooling=CHUNK_POOLING):
+    # a running search server with the same quantization answers the search, otherwise it runs in this process
+    chunked_semantic_search = SearchClient.connect(quantization)
+    if chunked_semantic_search is None:
+        movies = load_movies()
+        chunked_semantic_search = ChunkedSemanticSearch(quantization=quantization)
+        chunked_semantic_search.load_or_create_chunk_embeddings(movies['movies'])
+    results = chunked_semantic_search.search_chunks(query, limit, nprobe, pooling)
 
     for i, result in enumerate(results, start=1):
         print(f"\n{i}. {result["title"]} (score: {result["score"]:.4f})")
         print(f"   {result["document"]}...")
 
-def cmd_embed_chunks():
+def cmd_embed_chunks(workers=EMBED_WORKERS):
     movies = load_movies()
-    chunked_semantic_search = ChunkedSemanticSearch()
+    chunked_semantic_search = ChunkedSemanticSearch(encode_workers=workers)
     embeddings = chunked_semantic_search.load_or_create_chunk_embeddings(movies['movies'])
     print(f"Generated {len(embeddings)} chunked embeddings")
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from multiprocessing import get_context
+import numpy as np
+from .semantic_search_util import EMBED_BATCH_SIZE, EMBED_WORKERS
+
+# the model of a pool worker, loaded once by its initializer
+worker_model = None
+# models are first used from search threads as well, only one of them loads a model
+model_lock = threading.Lock()
+
+
+class EmbeddingEncoder:
+    # encodes corpus texts in batches of similar token length, so little of a batch is padding. With more
+    # than one worker the batches are spread over a pool of processes that each load their own copy of the
+    # model; rows always come back in input order. The model itself is only loaded by the first encode
+    def __init__(self, model_name, workers=EMBED_WORKERS, batch_size=EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor = None
+        self.encoded = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    @property
+    def model(self):
+        return load_model(self.model_name)
+
+    @property
+    def throughput(self):
+        return self.encoded / self.seconds if self.seconds else 0.0
+
+    def encode(self, texts) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        start = time.perf_counter()
+        order = np.argsort(token_lengths(self.model, texts), kind="stable")
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        batch_texts = [[texts[i] for i in batch.tolist()] for batch in batches]
+        if self.workers > 1 and len(batches) > 1:
+            encoded = self.__pool().map(encode_in_worker, batch_texts)
+        else:
+            encoded = (self.model.encode(texts_of_batch) for texts_of_batch in batch_texts)
+        embeddings = None
+        for batch, batch_embeddings in zip(batches, encoded):
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_embeddings
+        self.encoded += len(texts)
+        self.seconds += time.perf_counter() - start
+        return embeddings
+
+    def __pool(self):
+        # spawned, not forked: a forked copy of a process that already runs torch threads can deadlock
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"), initializer=load_worker_model, initargs=(self.model_name, max(1, (os.cpu_count() or 1) // self.workers)))
+        return self.executor
+
+
+def load_model(model_name):
+    # sentence_transformers pulls in torch and takes seconds to import, so it is imported with the first
+    # model; every user of a model name in the process shares one loaded copy
+    with model_lock:
+        return loaded_model(model_name)
+
+
+@cache
+def loaded_model(model_name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def token_lengths(model, texts):
+    # characters stand in for tokens when the model has no text tokenizer
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return [len(text) for text in texts]
+    return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+def load_worker_model(model_name, threads):
+    global worker_model
+    import torch
+    torch.set_num_threads(threads)
+    worker_model = load_model(model_name)
+
+
+def encode_in_worker(texts):
+    return worker_model.encode(texts)
@@ -1,105 +1,185 @@
 import os
+import time
 import logging
 logger = logging.getLogger(__name__)
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+import numpy as np
 from .inverted_index import InvertedIndex
 from .chunked_semantic_search import ChunkedSemanticSearch
+from .query_cache import normalize_query
+from .result_cache import SearchResultCache
+from .search_utils import HYBRID_LEG_WORKERS, RESULT_CACHE_DISK, RESULT_CACHE_PATH
+from .semantic_search_util import EMBEDDING_QUANTIZATION
+from .top_k import top_k_indices
 
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(self, documents, leg_workers=HYBRID_LEG_WORKERS, quantization=EMBEDDING_QUANTIZATION, result_cache_disk=RESULT_CACHE_DISK):
         self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
+        self.leg_executor = shared_leg_executor(leg_workers) if leg_workers > 1 else None
+        self.result_cache = SearchResultCache(path=RESULT_CACHE_PATH if result_cache_disk else None)
+        self.semantic_search = ChunkedSemanticSearch(quantization=quantization)
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
+        # catalog changes since the last run are applied as small segments instead of a rebuild
         self.idx = InvertedIndex()
         if not os.path.exists(self.idx.index_path):
-            self.idx.build()
+            self.idx.build(documents)
             self.idx.save()
-
-    def _bm25_search(self, query, limit):
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
+        else:
+            self.idx.sync(documents)
+
+        # both legs are fused on arrays indexed by position in documents, BM25 doc ids are mapped there
+        doc_ids = np.array([doc["id"] for doc in documents], dtype=np.int64)
+        self.id_order = np.argsort(doc_ids, kind="stable")
+        self.sorted_ids = doc_ids[self.id_order]
+
+    @property
+    def version(self):
+        # of the keyword index and chunk embeddings loaded now, cached results of another version are dropped
+        return f"{self.idx.version}-{self.semantic_search.version}"
+
+    def _bm25_top_many(self, queries, limit):
+        # the index stays loaded, it is only reopened when another process saved a new version
+        self.idx.refresh()
+        return [self.__positions(doc_ids, scores) for doc_ids, scores in self.idx.bm25_top_many(queries, limit)]
+
+    def __positions(self, doc_ids, scores):
+        # positions in documents of the BM25 hits, in ranking order. A reloaded index can hold documents another
+        # process added since, they are not in documents and are dropped
+        if len(self.sorted_ids) == 0:
+            return np.zeros(0, dtype=np.int64), scores[:0]
+        found = np.minimum(np.searchsorted(self.sorted_ids, doc_ids), len(self.sorted_ids) - 1)
+        known = self.sorted_ids[found] == doc_ids
+        return self.id_order[found[known]], scores[known]
 
     def weighted_search(self, query, alpha, limit=5):
-        bm25_search_result = self._bm25_search(query,limit * 500)
-        chunked_search_result = self.semantic_search.search_chunks(query, limit * 500)
-
-        bm25_normalized = self.__normalize_search_results(bm25_search_result)
-        chunked_normalized = self.__normalize_search_results(chunked_search_result)
-
-        combined_scores = {}
-
-        for doc in bm25_normalized:
-            doc_id = doc["id"]
-            if doc_id not in combined_scores:
-                combined_scores[doc["id"]] = {
-                    "title": doc["title"],
-                    "document": doc["document"],
-                    "bm25_score": doc["normalized_score"]
-                }
-            combined_scores[doc_id]["bm25_score"] = doc["normalized_score"]
-
-        for doc in chunked_normalized:
-            doc_id = doc["id"]
-            if doc_id not in combined_scores:
-                combined_scores[doc["id"]] = {
-                    "title": doc["title"],
-                    "document": doc["document"],
-                    "semantic_score": doc["normalized_score"]
-                }
-            combined_scores[doc_id]["semantic_score"] = doc["normalized_score"]
-            
-        for doc_id, data in combined_scores.items():
-            hybrid_score_value = hybrid_score(data["bm25_score"], data["semantic_score"])
-            combined_scores[doc_id]["hybrid_score"] = hybrid_score_value
-            
-        combined_scores = sorted(combined_scores.values(),key=lambda value : value["hybrid_score"], reverse=True)
-        return combined_scores[:limit]
-
-    def __normalize_search_results(self, results):
-        scores = []
-        for result in results:
-            scores.append(result["score"])
-
-        normalized = _normalize_score(scores)
-        for i, result in enumerate(results):
-            result["normalized_score"] = normalized[i]
-
+        return self.weighted_search_many([query], alpha, limit)[0]
+
+    def weighted_search_many(self, queries, alpha, limit=5):
+        return self.weighted_search_many_with_timings(queries, alpha, limit)[0]
+
+    def weighted_search_many_with_timings(self, queries, alpha, limit=5):
+        # both legs run once for the queries of the batch not in the result cache, the semantic leg encodes
+        # them in one model call
+        return self.__cached_search("weighted", {"alpha": alpha, "limit": limit}, queries,
+                                    lambda bm25_legs, semantic_legs: [self.__weighted_fusion(bm25_leg, semantic_leg, alpha, limit) for bm25_leg, semantic_leg in zip(bm25_legs, semantic_legs)])
+
+    def __weighted_fusion(self, bm25_leg, semantic_leg, alpha, limit):
+        # min-max normalized leg scores, 0 for a document a leg did not return, weighted by alpha
+        bm25_rows, bm25_scores = bm25_leg
+        semantic_rows, semantic_scores = semantic_leg[:2]
+        bm25_normalized = np.zeros(len(self.documents), dtype=bm25_scores.dtype)
+        bm25_normalized[bm25_rows] = normalize_scores(bm25_scores)
+        semantic_normalized = np.zeros(len(self.documents), dtype=semantic_scores.dtype)
+        semantic_normalized[semantic_rows] = normalize_scores(semantic_scores)
+        candidates, in_bm25 = self.__candidates(bm25_rows, semantic_rows)
+        hybrid_scores = hybrid_score(bm25_normalized[candidates], semantic_normalized[candidates], alpha)
+
+        results = []
+        for i in top_k_indices(hybrid_scores, limit).tolist():
+            row = candidates[i]
+            results.append({
+                "id": self.documents[row]["id"],
+                "title": self.documents[row]["title"],
+                "document": self.__document_text(row, in_bm25),
+                "bm25_score": float(bm25_normalized[row]),
+                "semantic_score": float(semantic_normalized[row]),
+                "hybrid_score": float(hybrid_scores[i])
+            })
         return results
-    
+
     def rrf_search(self, query, k, limit=10):
-        bm25_search_result = self._bm25_search(query,limit * 500)
-        chunked_search_result = self.semantic_search.search_chunks(query, limit * 500)
-
-        combined_results = {}
-
-        for rank, doc in enumerate(bm25_search_result, start=1):
-            doc_id = doc["id"]
-            if doc_id not in combined_results:
-                combined_results[doc["id"]] = {
-                    "title": doc["title"],
-                    "document": doc["document"],
-                    "bm25_rank": rank,
-                    "semantic_rank": None,
-                    "rrf_score": 0.0
-                }
-                combined_results[doc_id]["rrf_score"] += rrf_score(rank, k)
-
-
-        for rank, doc in enumerate(chunked_search_result, start=1):
-            doc_id = doc["id"]
-            if doc_id not in combined_results:
-                combined_results[doc["id"]] = {
-                    "title": doc["title"],
-                    "document": doc["document"],
-                    "bm25_rank": None,
-                    "semantic_rank": rank,
-                    "rrf_score": 0.0
-                }
-            else:
-                combined_results[doc_id]["semantic_rank"] = rank
-            combined_results[doc_id]["rrf_score"] += rrf_score(rank, k)
-
-        return sorted(combined_results.values(), key=lambda value: value["rrf_score"], reverse=True)[:limit]
+        return self.rrf_search_many([query], k, limit)[0]
+
+    def rrf_search_many(self, queries, k, limit=10):
+        return self.rrf_search_many_with_timings(queries, k, limit)[0]
+
+    def rrf_search_many_with_timings(self, queries, k, limit=10):
+        return self.__cached_search("rrf", {"k": k, "limit": limit}, queries,
+                                    lambda bm25_legs, semantic_legs: [self.__rrf_fusion(bm25_leg, semantic_leg, k, limit) for bm25_leg, semantic_leg in zip(bm25_legs, semantic_legs)])
+
+    def __cached_search(self, method, params, queries, fuse):
+        # the results and, apart from them so they never reach a prompt, the timings of each query: the leg
+        # timings of its batch and "cached": False when it was searched now, only "cached": True otherwise
+        self.idx.refresh()
+        timings = {}
+        searched = set()
+
+        def search_many(missing):
+            bm25_legs, semantic_legs, leg_timings = self.__run_legs(missing, params["limit"] * 500)
+            timings.update(leg_timings, cached=False)
+            searched.update(normalize_query(query) for query in missing)
+            return fuse(bm25_legs, semantic_legs)
+
+        results = self.result_cache.get_or_compute_many(self.version, method, params, queries, search_many)
+        return results, [timings if normalize_query(query) in searched else {"cached": True} for query in queries]
+
+    def __run_legs(self, queries, limit):
+        # query encoding and numpy scoring release the GIL, so on the leg pool the two legs overlap and a
+        # batch takes about as long as its slower leg. Both are joined before fusion. The semantic leg scores every
+        # chunk, an ANN probe would drop movies from the limit * 500 candidates before they are fused
+        timings = {}
+
+        def timed(name, leg, *args):
+            start = time.perf_counter()
+            result = leg(*args)
+            timings[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+            return result
+
+        start = time.perf_counter()
+        if self.leg_executor is None:
+            bm25_legs = timed("bm25", self._bm25_top_many, queries, limit)
+            semantic_legs = timed("semantic", self.semantic_search.rank_chunks_many, queries, limit, 0)
+        else:
+            bm25_future = self.leg_executor.submit(timed, "bm25", self._bm25_top_many, queries, limit)
+            semantic_future = self.leg_executor.submit(timed, "semantic", self.semantic_search.rank_chunks_many, queries, limit, 0)
+            bm25_legs, semantic_legs = bm25_future.result(), semantic_future.result()
+        timings["legs_ms"] = (time.perf_counter() - start) * 1000
+        return bm25_legs, semantic_legs, timings
+
+    def __rrf_fusion(self, bm25_leg, semantic_leg, k, limit):
+        # a document scores the sum of rrf_score of its rank in each leg that returned it
+        bm25_rows = bm25_leg[0]
+        semantic_rows = semantic_leg[0]
+        bm25_ranks = np.zeros(len(self.documents), dtype=np.int64)
+        bm25_ranks[bm25_rows] = np.arange(1, len(bm25_rows) + 1)
+        semantic_ranks = np.zeros(len(self.documents), dtype=np.int64)
+        semantic_ranks[semantic_rows] = np.arange(1, len(semantic_rows) + 1)
+        rrf_scores = np.zeros(len(self.documents))
+        rrf_scores[bm25_rows] += rrf_score(bm25_ranks[bm25_rows], k)
+        rrf_scores[semantic_rows] += rrf_score(semantic_ranks[semantic_rows], k)
+        candidates, in_bm25 = self.__candidates(bm25_rows, semantic_rows)
+
+        results = []
+        for i in top_k_indices(rrf_scores[candidates], limit).tolist():
+            row = candidates[i]
+            results.append({
+                "id": self.documents[row]["id"],
+                "title": self.documents[row]["title"],
+                "document": self.__document_text(row, in_bm25),
+                "bm25_rank": int(bm25_ranks[row]) or None,
+                "semantic_rank": int(semantic_ranks[row]) or None,
+                "rrf_score": float(rrf_scores[row])
+            })
+        return results
+
+    def __candidates(self, bm25_rows, semantic_rows):
+        # documents of either leg in the order they were first seen, BM25 ranking first, so equal fused
+        # scores keep that order
+        in_bm25 = np.zeros(len(self.documents), dtype=bool)
+        in_bm25[bm25_rows] = True
+        return np.concatenate((bm25_rows, semantic_rows[~in_bm25[semantic_rows]])), in_bm25
+
+    def __document_text(self, row, in_bm25):
+        # the BM25 leg returns whole descriptions, the semantic leg a 100 character preview
+        description = self.documents[row]["description"]
+        return description if in_bm25[row] else description[:100]
+
+@cache
+def shared_leg_executor(workers):
+    # one pool per size for the process, shared by every HybridSearch
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hybrid-leg")
 
 def rrf_score(rank, k=60):
         return 1 / (k + rank)
@@ -121,5 +201,16 @@ def _normalize_score(scores: list):
             results.append(normalized_score)
     return results
 
+def normalize_scores(scores) -> np.ndarray:
+    # min-max normalization of a score array, all equal scores become 1.0
+    scores = np.asarray(scores)
+    if len(scores) == 0:
+        return scores
+    min_score = scores.min()
+    max_score = scores.max()
+    if min_score == max_score:
+        return np.ones_like(scores)
+    return (scores - min_score) / (max_score - min_score)
+
 def hybrid_score(bm25_score, semantic_score, alpha=0.5):
     return alpha * bm25_score + (1 - alpha) * semantic_score
\ No newline at end of file
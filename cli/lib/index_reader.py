@@ -0,0 +1,260 @@
+import json
+import os
+import shutil
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+from .index_segment import IndexSegment, EMPTY_POSTINGS
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+TERM_CACHE_SIZE = 4096
+EMPTY_ROWS = np.zeros(0, dtype=np.int64)
+
+
+class IndexReader:
+    # the live documents of several immutable segments seen as one index. Global rows number the
+    # segments' rows back to back; rows listed in a segment's deleted array are masked out everywhere
+    def __init__(self, segments, deleted):
+        self.segments = segments
+        self.deleted = deleted
+        self.bases = [0]
+        for segment in segments:
+            self.bases.append(self.bases[-1] + len(segment))
+        self.row_count = self.bases[-1]
+        self.live = []
+        total_length = 0
+        deleted_count = 0
+        for segment, deleted_rows in zip(segments, deleted):
+            total_length += segment.total_length
+            if len(deleted_rows) == 0:
+                self.live.append(None)
+                continue
+            live = np.ones(len(segment), dtype=bool)
+            live[deleted_rows] = False
+            self.live.append(live)
+            deleted_count += len(deleted_rows)
+            total_length -= int(segment.doc_lengths[deleted_rows].sum())
+        self.positional = all(segment.positions is not None for segment in segments)
+        self.doc_count = self.row_count - deleted_count
+        self.total_length = total_length
+        self.term_cache = OrderedDict()
+
+    def __len__(self):
+        return self.doc_count
+
+    def term_info(self, term):
+        # (rows, tfs, max tf, min length) of a term's live postings, the bounds may come from deleted documents
+        if term in self.term_cache:
+            self.term_cache.move_to_end(term)
+            return self.term_cache[term]
+
+        rows_parts, tfs_parts = [], []
+        max_tf, min_length = 0, None
+        for segment, base, live in zip(self.segments, self.bases, self.live):
+            term_id = segment.term_id(term)
+            if term_id < 0:
+                continue
+            docs, tfs = segment.postings_at(term_id)
+            if live is not None:
+                keep = live[docs]
+                docs, tfs = docs[keep], tfs[keep]
+            rows_parts.append(docs + base if base else docs)
+            tfs_parts.append(tfs)
+            segment_max_tf, segment_min_length = segment.term_bounds_at(term_id)
+            max_tf = max(max_tf, segment_max_tf)
+            min_length = segment_min_length if min_length is None else min(min_length, segment_min_length)
+
+        if not rows_parts:
+            info = (EMPTY_POSTINGS, EMPTY_POSTINGS, 0, 0)
+        elif len(rows_parts) == 1:
+            info = (rows_parts[0], tfs_parts[0], max_tf, min_length)
+        else:
+            info = (np.concatenate(rows_parts), np.concatenate(tfs_parts), max_tf, min_length)
+
+        self.term_cache[term] = info
+        if len(self.term_cache) > TERM_CACHE_SIZE:
+            self.term_cache.popitem(last=False)
+        return info
+
+    def postings(self, term):
+        rows, tfs, _, _ = self.term_info(term)
+        return rows, tfs
+
+    def term_bounds(self, term):
+        _, _, max_tf, min_length = self.term_info(term)
+        return max_tf, min_length
+
+    def doc_freq(self, term) -> int:
+        return len(self.term_info(term)[0])
+
+    def positions(self, term, rows):
+        # word positions of the term in the given sorted rows, which must all contain it; the positions
+        # of rows[i] are positions[offsets[i]:offsets[i + 1]]
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets_parts, positions_parts = [np.zeros(1, dtype=np.int64)], [EMPTY_ROWS]
+        segment_of_row = np.searchsorted(self.bases, rows, side="right") - 1
+        for i in np.unique(segment_of_row).tolist():
+            segment = self.segments[i]
+            offsets, positions = segment.positions_at(segment.term_id(term), rows[segment_of_row == i] - self.bases[i])
+            offsets_parts.append(offsets[1:] + offsets_parts[-1][-1])
+            positions_parts.append(positions)
+        return np.concatenate(offsets_parts), np.concatenate(positions_parts)
+
+    def locate(self, row):
+        i = bisect_right(self.bases, row) - 1
+        return i, row - self.bases[i]
+
+    def is_live(self, row) -> bool:
+        i, local_row = self.locate(row)
+        return self.live[i] is None or bool(self.live[i][local_row])
+
+    def live_rows(self):
+        for i, live in enumerate(self.live):
+            if live is None:
+                yield from range(self.bases[i], self.bases[i + 1])
+            else:
+                yield from (self.bases[i] + local_row for local_row in np.flatnonzero(live).tolist())
+
+    def live_doc_ids(self):
+        for segment, live in zip(self.segments, self.live):
+            yield from (segment.doc_ids if live is None else segment.doc_ids[live]).tolist()
+
+    def live_documents(self):
+        # (doc id, stored json) pairs, the json is left undecoded
+        for segment, live in zip(self.segments, self.live):
+            doc_ids = segment.doc_ids.tolist()
+            rows = range(len(segment)) if live is None else np.flatnonzero(live).tolist()
+            for row in rows:
+                yield doc_ids[row], segment.documents[row]
+
+    def doc_lengths_of(self, rows):
+        return self.__gather("doc_lengths", rows)
+
+    def doc_ids_of(self, rows):
+        return self.__gather("doc_ids", rows)
+
+    def __gather(self, name, rows):
+        if len(self.segments) == 1:
+            return getattr(self.segments[0], name)[rows]
+        rows = np.asarray(rows)
+        segment_of_row = np.searchsorted(self.bases, rows, side="right") - 1
+        values = np.zeros(len(rows), dtype=getattr(self.segments[0], name).dtype)
+        for i in np.unique(segment_of_row).tolist():
+            in_segment = segment_of_row == i
+            values[in_segment] = getattr(self.segments[i], name)[rows[in_segment] - self.bases[i]]
+        return values
+
+    def document(self, row) -> dict:
+        i, local_row = self.locate(row)
+        return self.segments[i].document(local_row)
+
+    def raw_document(self, row) -> str:
+        i, local_row = self.locate(row)
+        return self.segments[i].documents[local_row]
+
+    def row_of(self, doc_id) -> int:
+        # an updated document lives in the newest segment, its older copies are deleted
+        for i in range(len(self.segments) - 1, -1, -1):
+            local_row = self.segments[i].row_of(doc_id)
+            if local_row >= 0 and (self.live[i] is None or self.live[i][local_row]):
+                return self.bases[i] + local_row
+        return -1
+
+    def term_frequency(self, row, term) -> int:
+        i, local_row = self.locate(row)
+        if self.live[i] is not None and not self.live[i][local_row]:
+            return 0
+        return self.segments[i].term_frequency(local_row, term)
+
+
+class DocumentMap(Mapping):
+    # docmap view over the index, documents are decoded on access
+    def __init__(self, reader: IndexReader):
+        self.reader = reader
+
+    def __getitem__(self, doc_id):
+        row = self.reader.row_of(doc_id)
+        if row < 0:
+            raise KeyError(doc_id)
+        return self.reader.document(row)
+
+    def __iter__(self):
+        return self.reader.live_doc_ids()
+
+    def __len__(self):
+        return len(self.reader)
+
+
+def read_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != MANIFEST_FORMAT_VERSION:
+        raise ValueError(f"unsupported index manifest version {manifest['format_version']}")
+    return manifest
+
+
+def manifest_mtime(index_dir):
+    try:
+        return os.stat(os.path.join(index_dir, MANIFEST_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(index_dir, manifest):
+    # the manifest is replaced atomically, it is the only file a reader trusts to list live segments
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    remove_unreferenced_files(index_dir, manifest)
+
+
+def new_manifest(previous):
+    if previous is None:
+        return {"format_version": MANIFEST_FORMAT_VERSION, "version": 1, "next_segment": 1, "segments": []}
+    return {**previous, "version": previous["version"] + 1, "segments": [dict(entry) for entry in previous["segments"]]}
+
+
+def next_segment_name(manifest):
+    name = f"segment_{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    return name
+
+
+def deleted_file_name(segment_name, version):
+    # a new file per version, so a reader holding an older manifest keeps a consistent view
+    return f"{segment_name}.deleted.{version}.npy"
+
+
+def open_reader(index_dir, manifest) -> IndexReader:
+    segments = []
+    deleted = []
+    for entry in manifest["segments"]:
+        segments.append(IndexSegment.load(os.path.join(index_dir, entry["name"])))
+        if entry["deleted"] is None:
+            deleted.append(EMPTY_ROWS)
+        else:
+            deleted.append(np.load(os.path.join(index_dir, entry["deleted"])))
+    return IndexReader(segments, deleted)
+
+
+def remove_unreferenced_files(index_dir, manifest):
+    referenced = {MANIFEST_FILE}
+    for entry in manifest["segments"]:
+        referenced.add(entry["name"])
+        if entry["deleted"] is not None:
+            referenced.add(entry["deleted"])
+    for name in os.listdir(index_dir):
+        if name in referenced:
+            continue
+        path = os.path.join(index_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
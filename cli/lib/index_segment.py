@@ -0,0 +1,341 @@
+import json
+import mmap
+import os
+import shutil
+from bisect import bisect_left
+from itertools import chain
+import numpy as np
+
+SEGMENT_FORMAT_VERSION = 2
+META_FILE = "meta.json"
+EMPTY_POSTINGS = np.zeros(0, dtype=np.int32)
+
+
+def map_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_array(path):
+    # plain ndarray view over the mapping, np.memmap indexing goes through a python level __getitem__
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+def postings_bounds(postings_offsets, postings_docs, postings_tfs, doc_lengths):
+    if len(postings_offsets) <= 1:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    starts = postings_offsets[:-1]
+    max_tfs = np.maximum.reduceat(postings_tfs, starts).astype(np.int32)
+    min_lengths = np.minimum.reduceat(doc_lengths[postings_docs], starts).astype(np.int32)
+    return max_tfs, min_lengths
+
+
+def narrowest_unsigned(values):
+    return values.astype(np.min_scalar_type(int(values.max()) if len(values) else 0))
+
+
+def encode_positions(position_lists):
+    # each posting's block holds its first word position followed by the gaps to the next ones,
+    # all stored in the narrowest unsigned type that fits; decoding a block is one cumsum
+    positions_offsets = np.zeros(len(position_lists) + 1, dtype=np.int64)
+    np.cumsum([len(positions) for positions in position_lists], out=positions_offsets[1:])
+    flat = np.fromiter(chain.from_iterable(position_lists), dtype=np.int64, count=int(positions_offsets[-1]))
+    deltas = np.diff(flat, prepend=0)
+    starts = positions_offsets[:-1][np.diff(positions_offsets) > 0]
+    deltas[starts] = flat[starts]
+    return positions_offsets, narrowest_unsigned(deltas)
+
+
+def gather_blocks(offsets, values, order):
+    # reorders the variable length blocks values[offsets[i]:offsets[i + 1]] into the given order
+    starts = offsets[order]
+    lengths = offsets[order + 1] - starts
+    new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    indices = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return new_offsets, values[indices]
+
+
+class StringTable:
+    # utf-8 strings packed back to back in one blob, string i is blob[offsets[i]:offsets[i + 1]]
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def save(self, path, name):
+        with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+            f.write(self.blob)
+        np.save(os.path.join(path, f"{name}_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, path, name):
+        return cls(map_file(os.path.join(path, f"{name}.bin")), load_array(os.path.join(path, f"{name}_offsets.npy")))
+
+
+class IndexSegment:
+    # terms are sorted, postings of term i are postings_docs/postings_tfs[postings_offsets[i]:postings_offsets[i + 1]]
+    # and hold segment rows in increasing order; row r is the document doc_ids[r] and doc_order sorts rows by doc id.
+    # max_tfs/min_lengths hold the largest tf and the shortest document in each term's postings. A positional
+    # segment also holds the delta-encoded word positions of posting p in positions[positions_offsets[p]:positions_offsets[p + 1]]
+    def __init__(self, terms, postings_offsets, postings_docs, postings_tfs, max_tfs, min_lengths, doc_ids, doc_order, doc_lengths, documents, total_length, positions_offsets=None, positions=None):
+        self.terms = terms
+        self.postings_offsets = postings_offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.max_tfs = max_tfs
+        self.min_lengths = min_lengths
+        self.doc_ids = doc_ids
+        self.doc_order = doc_order
+        self.doc_lengths = doc_lengths
+        self.documents = documents
+        self.total_length = total_length
+        self.positions_offsets = positions_offsets
+        self.positions = positions
+
+    @classmethod
+    def from_term_frequencies(cls, documents, term_frequencies, doc_lengths):
+        postings = {}
+        for row, counter in enumerate(term_frequencies):
+            for term, tf in counter.items():
+                rows, tfs = postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+        return cls.from_postings(documents, postings, doc_lengths)
+
+    @classmethod
+    def from_postings(cls, documents, postings, doc_lengths, positional=False):
+        # postings maps term -> (rows, tfs) with rows in increasing order, or (rows, tfs, positions) when positional
+        terms = sorted(postings)
+        postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term][0]) for term in terms], out=postings_offsets[1:])
+        postings_count = int(postings_offsets[-1])
+        postings_docs = np.fromiter((row for term in terms for row in postings[term][0]), dtype=np.int32, count=postings_count)
+        postings_tfs = np.fromiter((tf for term in terms for tf in postings[term][1]), dtype=np.int32, count=postings_count)
+
+        doc_ids = np.array([doc["id"] for doc in documents], dtype=np.int64)
+        doc_lengths = np.array(doc_lengths, dtype=np.int32)
+        max_tfs, min_lengths = postings_bounds(postings_offsets, postings_docs, postings_tfs, doc_lengths)
+        positions_offsets, positions = None, None
+        if positional:
+            positions_offsets, positions = encode_positions([positions for term in terms for positions in postings[term][2]])
+        return cls(
+            StringTable.from_strings(terms),
+            postings_offsets,
+            postings_docs,
+            postings_tfs,
+            max_tfs,
+            min_lengths,
+            doc_ids,
+            np.argsort(doc_ids, kind="stable"),
+            doc_lengths,
+            StringTable.from_strings(json.dumps(doc) for doc in documents),
+            int(doc_lengths.sum()),
+            positions_offsets,
+            positions,
+        )
+
+    @classmethod
+    def merge(cls, segments, live_masks):
+        # the live documents of the segments back to back, postings are remapped to the new rows
+        # instead of re-tokenizing; live_masks holds a bool array per segment or None when nothing was deleted
+        vocabulary = np.array(sorted({segment.terms[i] for segment in segments for i in range(len(segment.terms))}), dtype=str)
+        positional = all(segment.positions is not None for segment in segments)
+        rows_parts, term_parts, tfs_parts = [], [], []
+        positions_offsets_parts, positions_parts = [np.zeros(1, dtype=np.int64)], []
+        doc_ids, doc_lengths, documents = [], [], []
+        base = 0
+        positions_total = 0
+        for segment, live in zip(segments, live_masks):
+            if live is None:
+                live = np.ones(len(segment), dtype=bool)
+            new_rows = np.cumsum(live) - 1 + base
+            new_rows[~live] = -1
+            segment_terms = np.array([segment.terms[i] for i in range(len(segment.terms))], dtype=str)
+            term_of_posting = np.repeat(np.searchsorted(vocabulary, segment_terms), np.diff(segment.postings_offsets))
+            rows = new_rows[segment.postings_docs]
+            keep = rows >= 0
+            rows_parts.append(rows[keep])
+            term_parts.append(term_of_posting[keep])
+            tfs_parts.append(segment.postings_tfs[keep])
+            if positional:
+                kept_offsets, kept_positions = gather_blocks(segment.positions_offsets, segment.positions, np.flatnonzero(keep))
+                # a segment without live postings adds no offsets, the running total carries over it
+                positions_offsets_parts.append(kept_offsets[1:] + positions_total)
+                positions_parts.append(kept_positions.astype(np.int64))
+                positions_total += int(kept_offsets[-1])
+
+            live_rows = np.flatnonzero(live)
+            doc_ids.append(segment.doc_ids[live_rows])
+            doc_lengths.append(segment.doc_lengths[live_rows])
+            documents.extend(segment.documents[row] for row in live_rows.tolist())
+            base += len(live_rows)
+
+        rows = np.concatenate(rows_parts) if rows_parts else np.zeros(0, dtype=np.int64)
+        term_of_posting = np.concatenate(term_parts) if term_parts else np.zeros(0, dtype=np.int64)
+        tfs = np.concatenate(tfs_parts) if tfs_parts else EMPTY_POSTINGS
+        order = np.lexsort((rows, term_of_posting))
+        postings_docs = rows[order].astype(np.int32)
+        postings_tfs = tfs[order].astype(np.int32)
+        # terms whose every document was deleted are dropped from the vocabulary
+        counts = np.bincount(term_of_posting, minlength=len(vocabulary))
+        used = counts > 0
+        postings_offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[used], out=postings_offsets[1:])
+
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int64)
+        doc_lengths = np.concatenate(doc_lengths) if doc_lengths else np.zeros(0, dtype=np.int32)
+        max_tfs, min_lengths = postings_bounds(postings_offsets, postings_docs, postings_tfs, doc_lengths)
+        positions_offsets, positions = None, None
+        if positional:
+            positions = np.concatenate(positions_parts) if positions_parts else np.zeros(0, dtype=np.int64)
+            positions_offsets, positions = gather_blocks(np.concatenate(positions_offsets_parts), positions, order)
+            positions = narrowest_unsigned(positions)
+        return cls(
+            StringTable.from_strings(vocabulary[used].tolist()),
+            postings_offsets,
+            postings_docs,
+            postings_tfs,
+            max_tfs,
+            min_lengths,
+            doc_ids,
+            np.argsort(doc_ids, kind="stable"),
+            doc_lengths,
+            StringTable.from_strings(documents),
+            int(doc_lengths.sum()),
+            positions_offsets,
+            positions,
+        )
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def term_id(self, term) -> int:
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def postings(self, term):
+        return self.postings_at(self.term_id(term))
+
+    def postings_at(self, term_id):
+        if term_id < 0:
+            return EMPTY_POSTINGS, EMPTY_POSTINGS
+        start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+        return self.postings_docs[start:end], self.postings_tfs[start:end]
+
+    def term_bounds_at(self, term_id):
+        return int(self.max_tfs[term_id]), int(self.min_lengths[term_id])
+
+    def positions_at(self, term_id, rows):
+        # word positions of the term in the given rows, which must all be in its postings: the positions
+        # of rows[i] are positions[offsets[i]:offsets[i + 1]]. Every block is decoded in one cumsum
+        start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+        postings = start + np.searchsorted(self.postings_docs[start:end], rows)
+        offsets, deltas = gather_blocks(self.positions_offsets, self.positions, postings)
+        positions = np.cumsum(deltas, dtype=np.int64)
+        block_starts = offsets[:-1]
+        positions -= np.repeat(positions[block_starts] - deltas[block_starts], np.diff(offsets))
+        return offsets, positions
+
+    def doc_freq(self, term) -> int:
+        return self.doc_freq_at(self.term_id(term))
+
+    def doc_freq_at(self, term_id) -> int:
+        if term_id < 0:
+            return 0
+        return int(self.postings_offsets[term_id + 1] - self.postings_offsets[term_id])
+
+    def term_frequency(self, row, term) -> int:
+        docs, tfs = self.postings(term)
+        i = np.searchsorted(docs, row)
+        if i < len(docs) and docs[i] == row:
+            return int(tfs[i])
+        return 0
+
+    def row_of(self, doc_id) -> int:
+        i = bisect_left(self.doc_order, doc_id, key=lambda row: self.doc_ids[row])
+        if i < len(self.doc_order) and self.doc_ids[self.doc_order[i]] == doc_id:
+            return int(self.doc_order[i])
+        return -1
+
+    def document(self, row) -> dict:
+        return json.loads(self.documents[row])
+
+    def save(self, path):
+        # write next to the live segment and swap it in, so readers never see a half-written directory
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        self.terms.save(tmp_path, "terms")
+        self.documents.save(tmp_path, "documents")
+        np.save(os.path.join(tmp_path, "postings_offsets.npy"), self.postings_offsets)
+        np.save(os.path.join(tmp_path, "postings_docs.npy"), self.postings_docs)
+        np.save(os.path.join(tmp_path, "postings_tfs.npy"), self.postings_tfs)
+        np.save(os.path.join(tmp_path, "max_tfs.npy"), self.max_tfs)
+        np.save(os.path.join(tmp_path, "min_lengths.npy"), self.min_lengths)
+        np.save(os.path.join(tmp_path, "doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(tmp_path, "doc_order.npy"), self.doc_order)
+        np.save(os.path.join(tmp_path, "doc_lengths.npy"), self.doc_lengths)
+        if self.positions is not None:
+            np.save(os.path.join(tmp_path, "positions_offsets.npy"), self.positions_offsets)
+            np.save(os.path.join(tmp_path, "positions.npy"), self.positions)
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump({
+                "format_version": SEGMENT_FORMAT_VERSION,
+                "doc_count": len(self),
+                "term_count": len(self.terms),
+                "total_length": int(self.total_length),
+                "positional": self.positions is not None,
+            }, f)
+
+        if os.path.exists(path):
+            old_path = f"{path}.old"
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+        if meta["format_version"] != SEGMENT_FORMAT_VERSION:
+            raise ValueError(f"unsupported index format version {meta['format_version']}")
+        positions_offsets, positions = None, None
+        if meta.get("positional", False):
+            positions_offsets = load_array(os.path.join(path, "positions_offsets.npy"))
+            positions = load_array(os.path.join(path, "positions.npy"))
+        return cls(
+            StringTable.load(path, "terms"),
+            load_array(os.path.join(path, "postings_offsets.npy")),
+            load_array(os.path.join(path, "postings_docs.npy")),
+            load_array(os.path.join(path, "postings_tfs.npy")),
+            load_array(os.path.join(path, "max_tfs.npy")),
+            load_array(os.path.join(path, "min_lengths.npy")),
+            load_array(os.path.join(path, "doc_ids.npy")),
+            load_array(os.path.join(path, "doc_order.npy")),
+            load_array(os.path.join(path, "doc_lengths.npy")),
+            StringTable.load(path, "documents"),
+            meta["total_length"],
+            positions_offsets,
+            positions,
+        )
+
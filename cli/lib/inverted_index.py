@@ -1,151 +1,581 @@
 
-from .search_utils import load_movies, CACHE_DIR,INDEX_PATH,DOCMAP_PATH, tokenization, TERM_FREQUENCIES_PATH, BM25_K1, DOC_LENGTH_PATH, BM25_B, DOC_LENGTH_PATH
-from pickle import dump, load
+from .search_utils import load_movies, INDEX_DIR, DOCMAP_PATH, tokenization, get_tokenizer, TERM_FREQUENCIES_PATH, BM25_K1, DOC_LENGTH_PATH, BM25_B
+from .index_segment import IndexSegment
+from .top_k import top_k_indices
+from .index_reader import IndexReader, DocumentMap, MANIFEST_FILE, EMPTY_ROWS, read_manifest, manifest_mtime, write_manifest, new_manifest, next_segment_name, deleted_file_name, open_reader
+from pickle import load
+import json
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, repeat
+import numpy as np
 import os, math
 
+# relative headroom on MaxScore upper bounds so float rounding in the summed bounds never prunes a real top-k hit
+MAX_SCORE_SLACK = 1e-9
+# more shards than workers keeps every process busy when descriptions vary in length
+BUILD_SHARDS_PER_WORKER = 4
+# past this many segments the update segments behind the first one are merged into one
+MAX_SEGMENTS = 8
+# (k1, b) pairs whose per-document length norms stay cached, enough for a parameter sweep
+LENGTH_NORM_CACHE_SIZE = 32
+
 class InvertedIndex:
-    def __init__(self):
-        self.index = {}
+    def __init__(self, index_dir=INDEX_DIR):
+        self.reader = None
+        self.manifest = None
+        self.manifest_mtime = None
+        # of the segments loaded now, set only by load() so it never runs ahead of them
+        self.version = None
         self.docmap = {}
-        self.term_frequencies = {}
-        self.doc_lengths = {}
-        self.index_path = INDEX_PATH
-
-    def __add_document(self, doc_id, text):
-        tokenized_text = tokenization(text)
-        counter = Counter()
-        self.doc_lengths[doc_id] = len(tokenized_text)
-        for token in tokenized_text:
-            if token not in self.index:
-                self.index[token] = {doc_id}
-            else:
-                self.index[token].add(doc_id)
-            counter[token] += 1
-        self.term_frequencies[doc_id] = counter
+        self.idf = {}
+        self.length_norms = {}
+        self.avg_doc_length = 0.0
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, MANIFEST_FILE)
 
     def get_document(self, term):
-        doc_ids = self.index.get(term.lower(), set())
-        return sorted(doc_ids)
-    
+        rows, _ = self.reader.postings(term.lower())
+        return sorted(self.reader.doc_ids_of(rows).tolist())
+
     def bm25(self, doc_id, term):
         bm_tf = self.__get_bm25_tf(doc_id, term)
         bm_idf = self.__get_bm25_idf(term)
         return bm_tf * bm_idf
-    
-    def bm25_search(self, query, limit) -> list[dict]:
+
+    def bm25_search(self, query, limit, exhaustive=False, k1=BM25_K1, b=BM25_B) -> list[dict]:
+        return self.__results(self.__bm25_ranking(query, limit, exhaustive, k1, b))
+
+    def bm25_search_many(self, queries, limit, exhaustive=False, k1=BM25_K1, b=BM25_B) -> list[list[dict]]:
+        # repeated queries are scored once; the reader's term cache keeps postings shared by the
+        # queries decoded between them
+        unique = {query: self.bm25_search(query, limit, exhaustive, k1, b) for query in dict.fromkeys(queries)}
+        return [unique[query] for query in queries]
+
+    def bm25_top(self, query, limit, exhaustive=False, k1=BM25_K1, b=BM25_B) -> tuple[np.ndarray, np.ndarray]:
+        # the ranking of bm25_search as arrays of doc ids and scores, for callers that fuse rankings
+        # without result dicts
+        scores_sorted = self.__bm25_ranking(query, limit, exhaustive, k1, b)
+        rows = np.array([row for row, _ in scores_sorted], dtype=np.int64)
+        return self.reader.doc_ids_of(rows), np.array([score for _, score in scores_sorted], dtype=np.float64)
+
+    def bm25_top_many(self, queries, limit, exhaustive=False, k1=BM25_K1, b=BM25_B) -> list[tuple[np.ndarray, np.ndarray]]:
+        unique = {query: self.bm25_top(query, limit, exhaustive, k1, b) for query in dict.fromkeys(queries)}
+        return [unique[query] for query in queries]
+
+    def __bm25_ranking(self, query, limit, exhaustive, k1, b):
         tokens = tokenization(query)
-        scores = {}
-    
-        for doc_id in self.docmap:
-            for token in tokens:
-                if doc_id not in scores:
-                    scores[doc_id] = self.bm25(doc_id, token)
-                else:
-                    scores[doc_id] += self.bm25(doc_id, token)
-
-        scores_sorted = sorted(scores.items(), key= lambda score: score[1], reverse=True)
+        if exhaustive:
+            scores_sorted = self.__bm25_exhaustive(tokens, limit, k1, b)
+        else:
+            scores_sorted = self.__bm25_top_k(tokens, limit, k1, b)
+        return self.__pad_with_unmatched(scores_sorted, tokens, limit)[:limit]
+
+    def phrase_search(self, query, limit, k1=BM25_K1, b=BM25_B) -> list[dict]:
+        # documents holding the query words in order and at the query's word distances; stopwords keep
+        # their slot, so "the dark knight" wants "knight" right after "dark". Matches are ranked by BM25
+        positioned = get_tokenizer().tokenize_with_positions(query)
+        tokens = [token for token, _ in positioned]
+        offsets = [position - positioned[0][1] for _, position in positioned]
+        candidates = self.__positional_candidates(tokens)
+        if len(candidates) == 0:
+            return []
+        # a phrase occurrence is a (candidate, start position) key that every token's positions,
+        # shifted back by the token's offset, agree on
+        positions = {token: self.reader.positions(token, candidates) for token in tokens}
+        starts = None
+        for token, offset in zip(tokens, offsets):
+            block_offsets, token_positions = positions[token]
+            owners = np.repeat(np.arange(len(candidates), dtype=np.int64), np.diff(block_offsets))
+            keys = (owners << 32) + (token_positions - offset + offsets[-1])
+            starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+        return self.__rank_matches(tokens, candidates[np.unique(starts >> 32)], limit, k1, b)
+
+    def proximity_search(self, query, distance, limit, k1=BM25_K1, b=BM25_B) -> list[dict]:
+        # documents holding every query word, in any order, within a window of distance words
+        tokens = tokenization(query)
+        distinct = list(dict.fromkeys(tokens))
+        candidates = self.__positional_candidates(distinct)
+        decoded = []
+        for token in distinct:
+            block_offsets, token_positions = self.reader.positions(token, candidates)
+            decoded.append((block_offsets.tolist(), token_positions.tolist()))
+        matched = [
+            row for i, row in enumerate(candidates.tolist())
+            if within_window([token_positions[block_offsets[i]:block_offsets[i + 1]] for block_offsets, token_positions in decoded], distance)
+        ]
+        return self.__rank_matches(tokens, matched, limit, k1, b)
+
+    def __positional_candidates(self, tokens):
+        # rows holding every token. The intersection starts at
+        # the rarest term and only probes the longer postings at the surviving rows with a binary search,
+        # which skips over the postings in between the way skip pointers would
+        if not self.reader.positional:
+            raise ValueError("index was built without positions")
+        distinct = list(dict.fromkeys(tokens))
+        if not distinct:
+            return EMPTY_ROWS
+        by_doc_freq = sorted(distinct, key=self.reader.doc_freq)
+        candidates, _ = self.reader.postings(by_doc_freq[0])
+        for token in by_doc_freq[1:]:
+            if len(candidates) == 0:
+                break
+            rows, _ = self.reader.postings(token)
+            candidates = candidates[contains_rows(rows, candidates)]
+        return candidates
+
+    def __rank_matches(self, tokens, matched, limit, k1, b):
+        rows = np.array(matched, dtype=np.int64)
+        scores = np.zeros(len(rows))
+        for token in tokens:
+            scores += self.__candidate_contributions(token, rows, k1, b)
+        return self.__results(self.__select_top(rows, scores, limit))
+
+    def __select_top(self, rows, scores, limit):
+        # rows are increasing, so ties on score come out in corpus order
+        top = top_k_indices(scores, limit)
+        return list(zip(rows[top].tolist(), scores[top].tolist()))
+
+    def __results(self, scores_sorted):
         results = []
-        for doc_id, score in scores_sorted[:limit]:
-            doc = self.docmap[doc_id]
+        for row, score in scores_sorted:
+            doc = self.reader.document(row)
             results.append({
-                "id": doc_id,
+                "id": doc["id"],
                 "title": doc["title"],
                 "document": doc["description"],
                 "score": score
             })
         return results
 
+    def __bm25_exhaustive(self, tokens, limit, k1, b):
+        rows, scores = self.bm25_scores(tokens, k1, b)
+        return self.__select_top(rows, scores, limit)
+
+    def bm25_scores(self, tokens, k1=BM25_K1, b=BM25_B):
+        # the postings are the columns of a sparse doc x term tf matrix, so each query term adds its whole
+        # column of BM25 weights to a dense score vector at once. Terms are added in query order, which keeps
+        # the scores bit-for-bit equal to summing bm25() per document. Returns the matched rows and their scores
+        length_norms = self.__length_norms(k1, b)
+        scores = np.zeros(self.reader.row_count)
+        matched = np.zeros(self.reader.row_count, dtype=bool)
+        for token in tokens:
+            rows, tfs = self.reader.postings(token)
+            if len(rows) == 0:
+                continue
+            scores[rows] += (tfs * (k1 + 1)) / (tfs + length_norms[rows]) * self.__token_idf(token)
+            matched[rows] = True
+        rows = np.flatnonzero(matched)
+        return rows, scores[rows]
+
+    def __length_norms(self, k1, b):
+        # k1 * (1 - b + b * |d| / avgdl) for every row, computed once per (k1, b) instead of per posting
+        key = (k1, b)
+        if key not in self.length_norms:
+            if len(self.length_norms) >= LENGTH_NORM_CACHE_SIZE:
+                self.length_norms.pop(next(iter(self.length_norms)))
+            doc_lengths = self.reader.doc_lengths_of(np.arange(self.reader.row_count))
+            self.length_norms[key] = k1 * (1 - b + b * (doc_lengths / self.avg_doc_length))
+        return self.length_norms[key]
+
+    def __bm25_top_k(self, tokens, limit, k1, b):
+        # MaxScore, term at a time: terms are scored in order of their max impact until the impact the
+        # remaining terms could still add cannot lift a new document past the current k-th partial score.
+        # From then on no new documents are admitted, the remaining postings are only probed for the
+        # surviving candidates, and candidates that can no longer reach the k-th score are dropped
+        if limit <= 0:
+            return []
+        counts = Counter(tokens)
+        terms = []
+        for token, count in counts.items():
+            if self.reader.doc_freq(token) == 0:
+                continue
+            max_tf, min_length = self.reader.term_bounds(token)
+            terms.append((self.__bm25_saturation(max_tf, min_length, k1, b) * self.__token_idf(token) * count, token))
+        terms.sort(reverse=True)
+        remaining_bounds = list(accumulate(bound for bound, _ in reversed(terms)))[::-1]
+
+        candidates = EMPTY_ROWS
+        partial = np.zeros(0)
+        for (_, token), remaining_bound in zip(terms, remaining_bounds):
+            threshold = self.__kth_score(partial, limit)
+            if threshold is None or self.__can_enter(remaining_bound, threshold):
+                rows, _ = self.reader.postings(token)
+                merged = np.union1d(candidates, rows)
+                merged_partial = np.zeros(len(merged))
+                merged_partial[np.searchsorted(merged, candidates)] = partial
+                candidates, partial = merged, merged_partial
+            else:
+                keep = self.__can_enter(partial + remaining_bound, threshold)
+                candidates, partial = candidates[keep], partial[keep]
+            partial += self.__candidate_contributions(token, candidates, k1, b) * counts[token]
+
+        # summed in query order, so the scores are bit-for-bit the exhaustive ones
+        contributions = {token: self.__candidate_contributions(token, candidates, k1, b) for token in counts}
+        scores = np.zeros(len(candidates))
+        for token in tokens:
+            scores += contributions[token]
+        return self.__select_top(candidates, scores, limit)
+
+    def __candidate_contributions(self, token, candidates, k1, b):
+        rows, tfs = self.reader.postings(token)
+        contributions = np.zeros(len(candidates))
+        if len(rows) == 0 or len(candidates) == 0:
+            return contributions
+        positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+        present = rows[positions] == candidates
+        tf = tfs[positions[present]]
+        doc_lengths = self.reader.doc_lengths_of(candidates[present])
+        contributions[present] = self.__bm25_saturation(tf, doc_lengths, k1, b) * self.__token_idf(token)
+        return contributions
+
+    def __kth_score(self, partial, limit):
+        if len(partial) < limit:
+            return None
+        return np.partition(partial, len(partial) - limit)[len(partial) - limit]
+
+    def __can_enter(self, upper_bound, threshold):
+        return upper_bound * (1 + MAX_SCORE_SLACK) > threshold
+
+    def __pad_with_unmatched(self, scores_sorted, tokens, limit):
+        # documents without any query term score 0 and keep corpus order,
+        # exactly as the full scan over the docmap ranked them
+        if len(scores_sorted) >= limit or not tokens:
+            return scores_sorted
+        padded = list(scores_sorted)
+        matched = {row for row, _ in scores_sorted}
+        for row in self.reader.live_rows():
+            if len(padded) >= limit:
+                break
+            if row not in matched:
+                padded.append((row, 0.0))
+        return padded
 
     def get_tf(self, doc_id, term) -> int:
-        tokens = tokenization(term)   
+        tokens = tokenization(term)
         if len(tokens) > 1:
             raise ValueError("more then one token given")
-        
+
         token = tokens[0]
 
-        if doc_id not in self.term_frequencies:
+        row = self.reader.row_of(doc_id)
+        if row < 0:
             return 0
-        return self.term_frequencies[doc_id].get(token, 0)
-    
+        return self.reader.term_frequency(row, token)
+
     def get_idf(self, term):
         tokens = tokenization(term)
         if len(tokens) > 1:
             raise ValueError("more then one token given")
-        
+
         token = tokens[0]
-        total_doc_count = len(self.docmap)
-        term_match_doc_count = len(self.index[token])
+        total_doc_count = len(self.reader)
+        term_match_doc_count = self.reader.doc_freq(token)
         return math.log((total_doc_count + 1) / (term_match_doc_count + 1))
-    
+
     def get_tf_idf(self, doc_id, term):
         return self.get_tf(doc_id, term) * self.get_idf(term)
-    
+
     def __get_bm25_idf(self, term: str) -> float:
         tokens = tokenization(term)
         if len(tokens) > 1:
             raise ValueError("more then one token given")
-        
+
         token = tokens[0]
-        total_doc_count = len(self.docmap)
-        if token not in self.index:
-            return 0.0
-        term_match_doc_count = len(self.index[token])
-        return math.log((total_doc_count - term_match_doc_count + 0.5) / (term_match_doc_count + 0.5) + 1)
-    
+        return self.__token_idf(token)
+
+    def __token_idf(self, token) -> float:
+        # computed from the live postings of every segment on first use, the vocabulary is never scanned as a whole
+        if token not in self.idf:
+            total_doc_count = len(self.reader)
+            term_match_doc_count = self.reader.doc_freq(token)
+            if term_match_doc_count == 0:
+                self.idf[token] = 0.0
+            else:
+                self.idf[token] = math.log((total_doc_count - term_match_doc_count + 0.5) / (term_match_doc_count + 0.5) + 1)
+        return self.idf[token]
+
     def bm25_idf_command(self, term):
         self.load()
         return self.__get_bm25_idf(term)
-    
+
     def bm25_tf_command(self, doc_id, term, k1=BM25_K1, b=BM25_B):
         self.load()
         return self.__get_bm25_tf(doc_id, term, k1, b)
-    
+
     def __get_bm25_tf(self, doc_id, term, k1=BM25_K1, b=BM25_B):
-        length_norm = 1 -b + b * (self.doc_lengths[doc_id] / self.__get_avg_doc_length())
+        row = self.reader.row_of(doc_id)
+        if row < 0:
+            raise KeyError(doc_id)
         raw_tf = self.get_tf(doc_id,term)
-        bm25_saturation = (raw_tf * (k1 + 1)) / (raw_tf + k1 * length_norm)
-        return bm25_saturation
-    
-    def __get_avg_doc_length(self) -> float:
-        total_length = 0
-        for doc_id in self.doc_lengths:
-            total_length += self.doc_lengths[doc_id]
-        if len(self.doc_lengths) == 0:
-            return 0.0
-        return total_length / len(self.doc_lengths)
-
-    def build(self):
-        movies = load_movies()
-        for movie in movies["movies"]:
-            self.docmap[movie["id"]] = movie
-            self.__add_document(movie["id"], f"{movie['title']} {movie['description']}")
+        return self.__bm25_saturation(raw_tf, int(self.reader.doc_lengths_of([row])[0]), k1, b)
 
-    def save(self):
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(INDEX_PATH, "wb") as f:
-            dump(self.index, f)
+    def __bm25_saturation(self, raw_tf, doc_length, k1=BM25_K1, b=BM25_B):
+        length_norm = 1 -b + b * (doc_length / self.avg_doc_length)
+        return (raw_tf * (k1 + 1)) / (raw_tf + k1 * length_norm)
 
-        with open(DOCMAP_PATH, "wb") as f:
-            dump(self.docmap, f)
+    def __compute_stats(self):
+        # document count and total length only cover live documents, so the stats match a full rebuild
+        doc_count = len(self.reader)
+        self.avg_doc_length = self.reader.total_length / doc_count if doc_count else 0.0
+        self.docmap = DocumentMap(self.reader)
+        self.idf = {}
+        self.length_norms = {}
 
-        with open(TERM_FREQUENCIES_PATH, "wb") as f:
-            dump(self.term_frequencies, f)
+    def build(self, documents=None, workers=1, positions=False):
+        if documents is None:
+            documents = load_movies()["movies"]
+        texts = [document_text(movie) for movie in documents]
+        if workers <= 1:
+            postings, doc_lengths = build_partial_postings(texts, positions)
+        else:
+            shard_count = workers * BUILD_SHARDS_PER_WORKER
+            shard_size = max(1, -(-len(texts) // shard_count))
+            shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                postings, doc_lengths = merge_partial_postings(executor.map(build_partial_postings, shards, repeat(positions)))
+        self.__use_segment(IndexSegment.from_postings(documents, postings, doc_lengths, positions))
 
-        with open(DOC_LENGTH_PATH, "wb") as f:
-            dump(self.doc_lengths, f)
+    def save(self):
+        # a saved build replaces every segment of the index on disk
+        os.makedirs(self.index_dir, exist_ok=True)
+        segment = self.reader.segments[0]
+        if len(self.reader.segments) > 1 or self.reader.live[0] is not None:
+            segment = IndexSegment.merge(self.reader.segments, self.reader.live)
+        manifest = new_manifest(read_manifest(self.index_dir))
+        name = next_segment_name(manifest)
+        segment.save(os.path.join(self.index_dir, name))
+        manifest["segments"] = [{"name": name, "deleted": None}]
+        self.__commit(manifest)
 
     def load(self):
-        if not os.path.exists(INDEX_PATH) or not os.path.exists(DOCMAP_PATH) or not os.path.exists(TERM_FREQUENCIES_PATH) or not os.path.exists(DOC_LENGTH_PATH):
-            raise FileNotFoundError("index or docmap or term frequencies file not found")
-        else:
-            with open(INDEX_PATH,"rb") as f:
-                self.index = load(f)
-            with open(DOCMAP_PATH, "rb") as f:
-                self.docmap = load(f)
-            with open(TERM_FREQUENCIES_PATH, "rb") as f:
-                self.term_frequencies = load(f)
-            with open(DOC_LENGTH_PATH, "rb") as f:
-                self.doc_lengths = load(f)
-
-    
\ No newline at end of file
+        # the segments are opened before anything is swapped, so a failed load keeps the current index
+        mtime = manifest_mtime(self.index_dir)
+        manifest = read_manifest(self.index_dir)
+        if manifest is None:
+            raise FileNotFoundError("index not found")
+        reader = open_reader(self.index_dir, manifest)
+        self.manifest, self.manifest_mtime, self.reader = manifest, mtime, reader
+        # changes with every write of the manifest, also when a removed index is built again from version 1
+        self.version = f"{manifest['version']}.{mtime}"
+        self.__compute_stats()
+
+    def refresh(self) -> bool:
+        # keeps a loaded index resident: a stat of the manifest tells whether anything was written since, and
+        # any new write reloads the segments. The version alone can't tell, a removed and rebuilt index starts
+        # again from version 1. Returns whether the index was reloaded
+        if self.manifest is None:
+            return False
+        if manifest_mtime(self.index_dir) == self.manifest_mtime:
+            return False
+        try:
+            self.load()
+        except FileNotFoundError:
+            # removed, or removed and not rebuilt yet: the loaded segments stay in use
+            return False
+        return True
+
+    def update_documents(self, upserts=(), deletes=()):
+        # upserted documents are tokenized into one new segment, their older copies and the deleted
+        # documents are masked out of the segments holding them; the cost follows the change, not the corpus
+        if self.manifest is None:
+            self.load()
+        upserts = list({doc["id"]: doc for doc in upserts}.values())
+        removed_ids = {doc["id"] for doc in upserts} | set(deletes)
+        manifest = new_manifest(self.manifest)
+        changed = False
+        for entry, segment, deleted_rows in zip(manifest["segments"], self.reader.segments, self.reader.deleted):
+            rows = np.array([row for row in (segment.row_of(doc_id) for doc_id in removed_ids) if row >= 0], dtype=np.int64)
+            rows = np.setdiff1d(rows, deleted_rows)
+            if len(rows) == 0:
+                continue
+            entry["deleted"] = deleted_file_name(entry["name"], manifest["version"])
+            np.save(os.path.join(self.index_dir, entry["deleted"]), np.union1d(deleted_rows, rows))
+            changed = True
+        if upserts:
+            positional = self.reader.positional
+            postings, doc_lengths = build_partial_postings([document_text(doc) for doc in upserts], positional)
+            name = next_segment_name(manifest)
+            IndexSegment.from_postings(upserts, postings, doc_lengths, positional).save(os.path.join(self.index_dir, name))
+            manifest["segments"].append({"name": name, "deleted": None})
+            changed = True
+        if not changed:
+            return
+        self.__commit(manifest)
+        if len(manifest["segments"]) > MAX_SEGMENTS:
+            self.merge(tail_only=True)
+
+    def add_documents(self, documents):
+        self.update_documents(upserts=documents)
+
+    def delete_documents(self, doc_ids):
+        self.update_documents(deletes=doc_ids)
+
+    def sync(self, documents):
+        # brings the saved index in line with the catalog: new and edited documents are upserted and
+        # documents missing from it are deleted, comparing against the json each segment stores
+        if self.manifest is None:
+            self.load()
+        stored = dict(self.reader.live_documents())
+        upserts = [doc for doc in documents if stored.get(doc["id"]) != json.dumps(doc)]
+        catalog_ids = {doc["id"] for doc in documents}
+        deletes = [doc_id for doc_id in stored if doc_id not in catalog_ids]
+        if upserts or deletes:
+            self.update_documents(upserts, deletes)
+        return len(upserts), len(deletes)
+
+    def merge(self, tail_only=False):
+        # a full merge folds every segment into one and drops deleted documents for good; the automatic
+        # merge keeps the first, largest segment and only folds the small update segments behind it
+        if self.manifest is None:
+            self.load()
+        first = 1 if tail_only else 0
+        entries = self.manifest["segments"][first:]
+        if not entries or (len(entries) == 1 and entries[0]["deleted"] is None):
+            return
+        merged = IndexSegment.merge(self.reader.segments[first:], self.reader.live[first:])
+        manifest = new_manifest(self.manifest)
+        name = next_segment_name(manifest)
+        merged.save(os.path.join(self.index_dir, name))
+        manifest["segments"] = manifest["segments"][:first] + [{"name": name, "deleted": None}]
+        self.__commit(manifest)
+
+    def __commit(self, manifest):
+        write_manifest(self.index_dir, manifest)
+        self.load()
+
+    def __use_segment(self, segment):
+        self.manifest = None
+        self.manifest_mtime = None
+        self.version = None
+        self.reader = IndexReader([segment], [EMPTY_ROWS])
+        self.__compute_stats()
+
+    def convert_pickles(self):
+        # reads the docmap, term frequencies and doc lengths pickles written by the old save();
+        # the term -> doc ids pickle carries nothing the term frequencies don't
+        if not os.path.exists(DOCMAP_PATH) or not os.path.exists(TERM_FREQUENCIES_PATH) or not os.path.exists(DOC_LENGTH_PATH):
+            raise FileNotFoundError("docmap or term frequencies or doc lengths pickle not found")
+        with open(DOCMAP_PATH, "rb") as f:
+            docmap = load(f)
+        with open(TERM_FREQUENCIES_PATH, "rb") as f:
+            term_frequencies = load(f)
+        with open(DOC_LENGTH_PATH, "rb") as f:
+            doc_lengths = load(f)
+
+        self.__use_segment(IndexSegment.from_term_frequencies(
+            list(docmap.values()),
+            [term_frequencies.get(doc_id, Counter()) for doc_id in docmap],
+            [doc_lengths[doc_id] for doc_id in docmap],
+        ))
+
+def document_text(doc):
+    return f"{doc['title']} {doc['description']}"
+
+def build_partial_postings(texts, positions=False):
+    # postings and lengths for one shard, rows are local to the shard. With positions each
+    # entry also lists the word positions of the term in every document
+    if positions:
+        return build_positional_postings(texts)
+    postings = {}
+    doc_lengths = []
+    for row, tokens in enumerate(get_tokenizer().tokenize_many(texts)):
+        doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            rows, tfs = postings.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(tf)
+    return postings, doc_lengths
+
+def build_positional_postings(texts):
+    postings = {}
+    doc_lengths = []
+    tokenizer = get_tokenizer()
+    for row, text in enumerate(texts):
+        positioned = tokenizer.tokenize_with_positions(text)
+        doc_lengths.append(len(positioned))
+        term_positions = {}
+        for term, position in positioned:
+            term_positions.setdefault(term, []).append(position)
+        for term, positions in term_positions.items():
+            rows, tfs, position_lists = postings.setdefault(term, ([], [], []))
+            rows.append(row)
+            tfs.append(len(positions))
+            position_lists.append(positions)
+    return postings, doc_lengths
+
+def merge_partial_postings(partials):
+    # shards are merged in corpus order, so every term's rows stay increasing and match a serial build
+    postings = {}
+    doc_lengths = []
+    for shard_postings, shard_lengths in partials:
+        offset = len(doc_lengths)
+        for term, (shard_rows, *shard_values) in shard_postings.items():
+            rows, *values = postings.setdefault(term, tuple([] for _ in range(1 + len(shard_values))))
+            rows.extend(row + offset for row in shard_rows)
+            for merged, shard in zip(values, shard_values):
+                merged.extend(shard)
+        doc_lengths.extend(shard_lengths)
+    return postings, doc_lengths
+
+def contains_rows(rows, candidates):
+    # which of the candidates appear in the sorted postings rows
+    if len(rows) == 0:
+        return np.zeros(len(candidates), dtype=bool)
+    positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+    return rows[positions] == candidates
+
+def within_window(positions, distance):
+    # sliding window over the merged positions for the shortest span holding every term once
+    occurrences = sorted((position, term) for term, term_positions in enumerate(positions) for position in term_positions)
+    counts = [0] * len(positions)
+    covered = 0
+    left = 0
+    for position, term in occurrences:
+        if counts[term] == 0:
+            covered += 1
+        counts[term] += 1
+        while covered == len(positions):
+            if position - occurrences[left][0] <= distance:
+                return True
+            left_term = occurrences[left][1]
+            counts[left_term] -= 1
+            if counts[left_term] == 0:
+                covered -= 1
+            left += 1
+    return False
+
+def cmd_convert_pickles():
+    inverted_index = InvertedIndex()
+    inverted_index.convert_pickles()
+    inverted_index.save()
+    print(f"Converted {len(inverted_index.reader)} documents to {INDEX_DIR}")
+
+def load_documents(path):
+    # a json list of movies, or an object with a "movies" list like data/movies.json
+    with open(path, "r") as f:
+        documents = json.load(f)
+    if isinstance(documents, dict):
+        documents = documents["movies"]
+    return documents
+
+def cmd_add_documents(path):
+    inverted_index = InvertedIndex()
+    documents = load_documents(path)
+    inverted_index.add_documents(documents)
+    print(f"Indexed {len(documents)} documents, {len(inverted_index.reader)} documents in {len(inverted_index.reader.segments)} segments")
+
+def cmd_delete_documents(doc_ids):
+    inverted_index = InvertedIndex()
+    inverted_index.delete_documents(doc_ids)
+    print(f"{len(inverted_index.reader)} documents in {len(inverted_index.reader.segments)} segments")
+
+def cmd_merge_segments():
+    inverted_index = InvertedIndex()
+    inverted_index.merge()
+    print(f"Merged into {len(inverted_index.reader.segments)} segment with {len(inverted_index.reader)} documents")
+
+def cmd_sync_documents():
+    inverted_index = InvertedIndex()
+    upserted, deleted = inverted_index.sync(load_movies()["movies"])
+    print(f"Upserted {upserted} and deleted {deleted} documents, {len(inverted_index.reader)} documents in {len(inverted_index.reader.segments)} segments")
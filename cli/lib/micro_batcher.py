@@ -0,0 +1,66 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from .semantic_search_util import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS
+
+
+class MicroBatcher:
+    # coalesces the encode calls of concurrent threads: a worker thread takes the first waiting request, waits
+    # at most max_wait_ms for more until max_batch texts are queued and encodes their distinct texts in one
+    # encode_many call. Every caller blocks until its own rows are back
+    def __init__(self, encode_many, max_batch=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+        self.encode_many = encode_many
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.encoded = 0
+        self.thread = threading.Thread(target=self.__run, name="query-batcher", daemon=True)
+        self.thread.start()
+
+    def encode(self, texts) -> list:
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future.result()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def __run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            count = len(request[0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # encode what was collected, then stop
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+                count += len(request[0])
+            self.__encode(batch)
+
+    def __encode(self, batch):
+        texts = list(dict.fromkeys(text for texts_of_request, _ in batch for text in texts_of_request))
+        try:
+            embeddings = dict(zip(texts, self.encode_many(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.encoded += len(texts)
+        for texts_of_request, future in batch:
+            future.set_result([embeddings[text] for text in texts_of_request])
@@ -1,32 +1,37 @@
-from PIL import Image
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from lib import search_utils
+from lib.semantic_search_util import normalize_rows, normalize_vector
+from lib.top_k import top_k_indices
+from lib.embedding_encoder import EmbeddingEncoder, load_model
 
 class MultiModalSearch:
     def __init__(self, documents, model_name="clip-ViT-B-32"):
-        self.model = SentenceTransformer(model_name)
+        self.model = load_model(model_name)
         self.documents = documents
         self.texts = [f"{doc['title']}: {doc['description']}" for doc in documents]
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        with EmbeddingEncoder(model_name) as encoder:
+            self.text_embeddings = encoder.encode(self.texts)
+        self.text_matrix = normalize_rows(self.text_embeddings)
     
     def search_with_image(self, image_path):
         image_embedding = self.embed_image(image_path=image_path)
 
+        scores = self.text_matrix @ normalize_vector(image_embedding)
+
         results = []
-        for i, embedding in enumerate(self.text_embeddings):
-            similarity_score = cosine_similarity(embedding, image_embedding)
+        for i in top_k_indices(scores, 5).tolist():
             results.append({
                         "doc_id": self.documents[i]["id"],
                         "title": self.documents[i]["title"],
                         "description": self.documents[i]["description"],
-                        "similarity_score" : similarity_score
+                        "similarity_score" : scores[i]
                             })
             
-        return sorted(results, key=lambda item: item["similarity_score"], reverse=True)[:5]
+        return results
 
 
     def embed_image(self, image_path):
+        from PIL import Image
         return self.model.encode([Image.open(image_path)])[0]
     
 
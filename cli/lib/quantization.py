@@ -0,0 +1,196 @@
+import os
+import numpy as np
+from .semantic_search_util import PQ_SUBSPACE_DIMS, PQ_TRAIN_SAMPLES, PQ_ITERATIONS, normalize_rows
+
+# rows decoded per block while scoring or encoding, bounds the float32 scratch memory
+QUANTIZED_BLOCK_SIZE = 4096
+QUANTIZATION_KINDS = ["float16", "int8", "pq"]
+
+
+class QuantizedMatrix:
+    # compressed unit length rows; `matrix @ query` gives approximate cosine scores and matrix[rows] a
+    # compressed subset, so it can stand in for the float32 matrix wherever rows are only scored
+    kind = None
+
+    def __init__(self, codes, params):
+        self.codes = codes
+        self.params = params
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return type(self)(self.codes[rows], self.params)
+
+    def __matmul__(self, query):
+        scores = np.zeros(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), QUANTIZED_BLOCK_SIZE):
+            scores[start:start + QUANTIZED_BLOCK_SIZE] = self.score_block(self.codes[start:start + QUANTIZED_BLOCK_SIZE], query)
+        return scores
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + sum(param.nbytes for param in self.params.values())
+
+    def decode(self) -> np.ndarray:
+        return np.concatenate([self.decode_block(self.codes[start:start + QUANTIZED_BLOCK_SIZE]) for start in range(0, len(self.codes), QUANTIZED_BLOCK_SIZE)])
+
+    @classmethod
+    def encode(cls, embeddings):
+        # embeddings are raw model output, rows are normalized block by block so a memory-mapped
+        # file is never loaded as a whole
+        params = cls.fit(embeddings)
+        blocks = [cls.encode_block(normalize_rows(embeddings[start:start + QUANTIZED_BLOCK_SIZE]), params) for start in range(0, len(embeddings), QUANTIZED_BLOCK_SIZE)]
+        return cls(np.concatenate(blocks), params)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, kind=self.kind, codes=self.codes, **self.params)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as arrays:
+            matrix_class = QUANTIZED_MATRIX_CLASSES[str(arrays["kind"])]
+            return matrix_class(arrays["codes"], {name: arrays[name] for name in arrays.files if name not in ("kind", "codes")})
+
+
+class Float16Matrix(QuantizedMatrix):
+    kind = "float16"
+
+    @classmethod
+    def fit(cls, embeddings):
+        return {}
+
+    @classmethod
+    def encode_block(cls, block, params):
+        return block.astype(np.float16)
+
+    def score_block(self, codes, query):
+        return codes.astype(np.float32) @ query
+
+    def decode_block(self, codes):
+        return codes.astype(np.float32)
+
+
+class Int8Matrix(QuantizedMatrix):
+    # one scale per dimension maps the largest absolute value seen in it to 127
+    kind = "int8"
+
+    @classmethod
+    def fit(cls, embeddings):
+        max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+        for start in range(0, len(embeddings), QUANTIZED_BLOCK_SIZE):
+            max_abs = np.maximum(max_abs, np.abs(normalize_rows(embeddings[start:start + QUANTIZED_BLOCK_SIZE])).max(axis=0))
+        return {"scales": np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)}
+
+    @classmethod
+    def encode_block(cls, block, params):
+        return np.clip(np.rint(block / params["scales"]), -127, 127).astype(np.int8)
+
+    def score_block(self, codes, query):
+        return codes.astype(np.float32) @ (query * self.params["scales"])
+
+    def decode_block(self, codes):
+        return codes.astype(np.float32) * self.params["scales"]
+
+
+class PQMatrix(QuantizedMatrix):
+    # product quantization: every PQ_SUBSPACE_DIMS wide slice of a row is replaced by the index of its nearest
+    # of 256 centroids learned for that slice. Scores sum a per-query table of slice x centroid dot products
+    kind = "pq"
+
+    @property
+    def shape(self):
+        codebooks = self.params["codebooks"]
+        return (len(self.codes), len(codebooks) * codebooks.shape[2])
+
+    @classmethod
+    def fit(cls, embeddings):
+        rng = np.random.default_rng(0)
+        sample = normalize_rows(embeddings[np.sort(rng.choice(len(embeddings), min(len(embeddings), PQ_TRAIN_SAMPLES), replace=False))])
+        subspaces = split_subspaces(sample)
+        centroid_count = min(256, len(sample))
+        return {"codebooks": np.stack([euclidean_kmeans(subspace, centroid_count, PQ_ITERATIONS, rng) for subspace in subspaces])}
+
+    @classmethod
+    def encode_block(cls, block, params):
+        codes = np.zeros((len(block), len(params["codebooks"])), dtype=np.uint8)
+        for m, subspace in enumerate(split_subspaces(block)):
+            codes[:, m] = nearest_centroids(subspace, params["codebooks"][m])
+        return codes
+
+    def score_block(self, codes, query):
+        codebooks = self.params["codebooks"]
+        table = np.einsum("mcd,md->mc", codebooks, query.reshape(len(codebooks), -1))
+        return table[np.arange(len(codebooks)), codes].sum(axis=1)
+
+    def decode_block(self, codes):
+        codebooks = self.params["codebooks"]
+        return np.concatenate([codebooks[m][codes[:, m]] for m in range(len(codebooks))], axis=1)
+
+
+QUANTIZED_MATRIX_CLASSES = {matrix_class.kind: matrix_class for matrix_class in (Float16Matrix, Int8Matrix, PQMatrix)}
+
+
+def split_subspaces(matrix):
+    dims = matrix.shape[1]
+    if dims % PQ_SUBSPACE_DIMS:
+        raise ValueError(f"embedding size {dims} is not a multiple of {PQ_SUBSPACE_DIMS}")
+    return [matrix[:, start:start + PQ_SUBSPACE_DIMS] for start in range(0, dims, PQ_SUBSPACE_DIMS)]
+
+
+def nearest_centroids(vectors, centroids):
+    # argmin of |v - c|^2 = |c|^2 - 2 v.c, the |v|^2 term is the same for every centroid
+    return np.argmin((centroids * centroids).sum(axis=1) - 2 * (vectors @ centroids.T), axis=1)
+
+
+def euclidean_kmeans(vectors, centroid_count, iterations, rng):
+    centroids = vectors[rng.choice(len(vectors), centroid_count, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=centroid_count)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+    return centroids.astype(np.float32)
+
+
+def quantize(kind, embeddings) -> QuantizedMatrix:
+    if kind not in QUANTIZED_MATRIX_CLASSES:
+        raise ValueError(f"unknown quantization {kind}, expected one of {', '.join(QUANTIZATION_KINDS)}")
+    return QUANTIZED_MATRIX_CLASSES[kind].encode(embeddings)
+
+
+def quantized_path(embeddings_path, kind):
+    return f"{os.path.splitext(embeddings_path)[0]}.{kind}.npz"
+
+
+def load_or_quantize(embeddings_path, embeddings, kind) -> QuantizedMatrix:
+    # codes for a different number of rows are stale; building embeddings removes their codes
+    path = quantized_path(embeddings_path, kind)
+    if os.path.exists(path):
+        quantized = QuantizedMatrix.load(path)
+        if len(quantized) == len(embeddings) and quantized.kind == kind:
+            return quantized
+    quantized = quantize(kind, embeddings)
+    quantized.save(path)
+    return quantized
+
+
+def remove_quantized(embeddings_path):
+    for kind in QUANTIZATION_KINDS:
+        if os.path.exists(quantized_path(embeddings_path, kind)):
+            os.remove(quantized_path(embeddings_path, kind))
+
+
+def rescore(embeddings, query, rows, approximate_scores, candidate_count):
+    # the candidate_count best approximate rows are scored again against the full precision rows, which
+    # for a memory-mapped file are the only rows read from disk. Returns those rows, increasing, and scores
+    candidates = np.sort(rows[np.argpartition(-approximate_scores, candidate_count - 1)[:candidate_count]]) if candidate_count < len(rows) else np.asarray(rows)
+    return candidates, normalize_rows(embeddings[candidates]) @ query
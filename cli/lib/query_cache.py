@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import cache
+import numpy as np
+from .semantic_search_util import QUERY_CACHE_PATH, QUERY_CACHE_SIZE, QUERY_CACHE_DISK_SIZE
+
+
+class QueryEmbeddingCache:
+    # query embeddings keyed by model name and query text with whitespace collapsed: an in-process LRU of
+    # capacity entries in front of a sqlite table that outlives the process and is shared by every process,
+    # holding at most the disk_capacity embeddings written last
+    def __init__(self, model_name, path=QUERY_CACHE_PATH, capacity=QUERY_CACHE_SIZE, disk_capacity=QUERY_CACHE_DISK_SIZE):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS query_embeddings (model TEXT, query TEXT, dtype TEXT, embedding BLOB, PRIMARY KEY (model, query))")
+        self.connection.commit()
+
+    def get_or_compute(self, query, compute) -> np.ndarray:
+        return self.get_or_compute_many([query], lambda keys: [compute(keys[0])])[0]
+
+    def get_or_compute_many(self, queries, compute_many) -> list[np.ndarray]:
+        # compute_many(keys) runs the model once for every distinct query found neither in memory nor on
+        # disk, outside the lock so other threads keep hitting the cache. The returned arrays are shared
+        # and read-only
+        keys = [normalize_query(query) for query in queries]
+        found = {}
+        missing = []
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                if key in self.entries:
+                    found[key] = self.entries[key]
+                    self.hits += 1
+                    continue
+                row = self.connection.execute("SELECT dtype, embedding FROM query_embeddings WHERE model = ? AND query = ?", (self.model_name, key)).fetchone()
+                if row is None:
+                    missing.append(key)
+                else:
+                    found[key] = np.frombuffer(row[1], dtype=row[0])
+                    self.disk_hits += 1
+        computed = []
+        if missing:
+            for embedding in compute_many(missing):
+                embedding = np.array(embedding)
+                embedding.setflags(write=False)
+                computed.append(embedding)
+        with self.lock:
+            self.misses += len(missing)
+            for key, embedding in zip(missing, computed):
+                self.connection.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)", (self.model_name, key, str(embedding.dtype), embedding.tobytes()))
+                found[key] = embedding
+            if missing:
+                # INSERT OR REPLACE gives a rewritten row a new rowid, so rowids follow the order rows were written
+                self.connection.execute("DELETE FROM query_embeddings WHERE rowid IN (SELECT rowid FROM query_embeddings ORDER BY rowid DESC LIMIT -1 OFFSET ?)", (self.disk_capacity,))
+                self.connection.commit()
+            for key, embedding in found.items():
+                self.entries[key] = embedding
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return [found[key] for key in keys]
+
+
+def normalize_query(query):
+    return " ".join(query.split())
+
+
+@cache
+def shared_query_cache(model_name) -> QueryEmbeddingCache:
+    # one cache per model for the whole process, every search class encoding queries goes through it
+    return QueryEmbeddingCache(model_name)
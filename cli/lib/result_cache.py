@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .query_cache import normalize_query
+from .search_utils import RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_DISK_SIZE
+
+
+class SearchResultCache:
+    # ranked results keyed by search method, its parameters and the query with whitespace collapsed, stored
+    # under the version of the indexes they were searched in: an LRU of capacity entries that expire after ttl
+    # seconds, in front of an optional sqlite table at path shared by every process. Results of another version
+    # are never returned, the first lookup under a new version drops them from both tiers
+    def __init__(self, capacity=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, path=None, disk_capacity=RESULT_CACHE_DISK_SIZE):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.disk_capacity = disk_capacity
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.connection = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS search_results (key TEXT PRIMARY KEY, version TEXT, stored_at REAL, results TEXT)")
+            self.connection.commit()
+
+    def get_or_compute_many(self, version, method, params, queries, compute_many) -> list[list[dict]]:
+        # compute_many(queries) searches every distinct query not cached, outside the lock. Every call returns
+        # new result dicts, a caller may change them
+        keys = [f"{method}\0{json.dumps(params, sort_keys=True)}\0{normalize_query(query)}" for query in queries]
+        now = time.time()
+        found = {}
+        missing = {}
+        with self.lock:
+            if version != self.version:
+                self.__invalidate(version)
+            for key, query in zip(keys, queries):
+                if key in found or key in missing:
+                    continue
+                entry = self.entries.get(key)
+                if entry is not None and now - entry[0] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[1]
+                    self.hits += 1
+                    continue
+                row = None
+                if self.connection is not None:
+                    row = self.connection.execute("SELECT stored_at, results FROM search_results WHERE key = ? AND version = ? AND stored_at >= ?", (key, version, now - self.ttl)).fetchone()
+                if row is None:
+                    missing[key] = query
+                else:
+                    self.__remember(key, row[0], row[1])
+                    found[key] = row[1]
+                    self.disk_hits += 1
+        computed = [json.dumps(results, default=json_default) for results in compute_many(list(missing.values()))] if missing else []
+        with self.lock:
+            self.misses += len(missing)
+            found.update(zip(missing, computed))
+            # results of a version replaced while they were searched are returned but not kept
+            if version == self.version and missing:
+                for key, results in zip(missing, computed):
+                    self.__remember(key, now, results)
+                if self.connection is not None:
+                    self.connection.executemany("INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)", [(key, version, now, results) for key, results in zip(missing, computed)])
+                    self.connection.execute("DELETE FROM search_results WHERE stored_at < ? OR rowid IN (SELECT rowid FROM search_results ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (now - self.ttl, self.disk_capacity))
+                    self.connection.commit()
+        return [json.loads(found[key]) for key in keys]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM search_results")
+                self.connection.commit()
+
+    def __remember(self, key, stored_at, results):
+        self.entries[key] = (stored_at, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def __invalidate(self, version):
+        self.entries.clear()
+        self.version = version
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM search_results WHERE version != ?", (version,))
+            self.connection.commit()
+
+
+def json_default(value):
+    # numpy scalars in search results
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
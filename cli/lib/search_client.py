@@ -0,0 +1,55 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from .search_utils import SEARCH_SERVER_HOST, SEARCH_SERVER_PORT, SEARCH_SERVER_CONNECT_TIMEOUT
+from .semantic_search_util import EMBEDDING_QUANTIZATION, IVF_NPROBE, CHUNK_POOLING
+
+
+class SearchClient:
+    # the search methods of HybridSearch and ChunkedSemanticSearch the CLIs use, answered by a running search
+    # server, so a CLI call skips loading the model, embeddings and indexes
+    def __init__(self, host=SEARCH_SERVER_HOST, port=SEARCH_SERVER_PORT):
+        self.url = f"http://{host}:{port}"
+
+    @classmethod
+    def connect(cls, quantization=EMBEDDING_QUANTIZATION, host=SEARCH_SERVER_HOST, port=SEARCH_SERVER_PORT):
+        # a client when a server searching the same quantization answers, otherwise None
+        client = cls(host, port)
+        status = client.status()
+        if status is None or status["quantization"] != quantization:
+            return None
+        return client
+
+    def status(self) -> dict | None:
+        try:
+            with urlopen(f"{self.url}/health", timeout=SEARCH_SERVER_CONNECT_TIMEOUT) as response:
+                return json.load(response)
+        except OSError:
+            return None
+
+    def rrf_search(self, query, k, limit=10):
+        return self.rrf_search_many([query], k, limit)[0]
+
+    def rrf_search_many(self, queries, k, limit=10):
+        return self.__search({"method": "rrf", "queries": queries, "k": k, "limit": limit})
+
+    def weighted_search(self, query, alpha, limit=5):
+        return self.weighted_search_many([query], alpha, limit)[0]
+
+    def weighted_search_many(self, queries, alpha, limit=5):
+        return self.__search({"method": "weighted", "queries": queries, "alpha": alpha, "limit": limit})
+
+    def search_chunks(self, query, limit=10, nprobe=IVF_NPROBE, pooling=CHUNK_POOLING):
+        return self.search_chunks_many([query], limit, nprobe, pooling)[0]
+
+    def search_chunks_many(self, queries, limit=10, nprobe=IVF_NPROBE, pooling=CHUNK_POOLING):
+        return self.__search({"method": "chunked", "queries": queries, "limit": limit, "nprobe": nprobe, "pooling": pooling})
+
+    def __search(self, request):
+        data = json.dumps(request).encode()
+        try:
+            with urlopen(Request(f"{self.url}/search", data=data, headers={"Content-Type": "application/json"})) as response:
+                return json.load(response)["results"]
+        except HTTPError as e:
+            # the server rejected the request, raised as the local search would have
+            raise ValueError(json.load(e)["error"]) from e
@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .embedding_encoder import load_model
+from .hybrid_search import HybridSearch
+from .micro_batcher import MicroBatcher
+from .result_cache import json_default
+from .search_utils import SEARCH_SERVER_HOST, SEARCH_SERVER_PORT, HYBRID_LEG_WORKERS, load_movies
+from .semantic_search_util import EMBEDDING_QUANTIZATION, IVF_NPROBE, CHUNK_POOLING, QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS
+logger = logging.getLogger(__name__)
+
+
+class SearchServer(ThreadingHTTPServer):
+    # keeps one HybridSearch, with its model, embeddings and indexes, loaded for every request. Each request
+    # runs on its own thread; their query embeddings go through one MicroBatcher, so queries arriving together
+    # share model calls, and the searches themselves run one at a time
+    daemon_threads = True
+
+    def __init__(self, address, hybrid_search: HybridSearch, max_batch=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+        super().__init__(address, SearchRequestHandler)
+        self.hybrid_search = hybrid_search
+        semantic_search = hybrid_search.semantic_search
+        self.batcher = MicroBatcher(lambda queries: list(semantic_search.model.encode(queries)), max_batch, max_wait_ms)
+        semantic_search.query_batcher = self.batcher
+        self.search_lock = threading.Lock()
+        self.requests = 0
+
+    def search(self, request) -> list[list[dict]]:
+        queries = request["queries"]
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("queries must be a list of strings")
+        semantic_search = self.hybrid_search.semantic_search
+        # the embeddings are encoded before taking the lock, the search then finds them in the query cache
+        if queries:
+            semantic_search.generate_embeddings(queries)
+        with self.search_lock:
+            self.requests += 1
+            match request["method"]:
+                case "rrf":
+                    return self.hybrid_search.rrf_search_many(queries, request.get("k", 60), request.get("limit", 10))
+                case "weighted":
+                    return self.hybrid_search.weighted_search_many(queries, request.get("alpha", 0.5), request.get("limit", 5))
+                case "chunked":
+                    return semantic_search.search_chunks_many(queries, request.get("limit", 10), request.get("nprobe", IVF_NPROBE), request.get("pooling", CHUNK_POOLING))
+                case method:
+                    raise ValueError(f"unknown method {method}")
+
+    def status(self) -> dict:
+        query_cache = self.hybrid_search.semantic_search.query_cache
+        result_cache = self.hybrid_search.result_cache
+        return {
+            "documents": len(self.hybrid_search.documents),
+            "quantization": self.hybrid_search.semantic_search.quantization,
+            "requests": self.requests,
+            "batches": self.batcher.batches,
+            "encoded": self.batcher.encoded,
+            "query_cache": {"hits": query_cache.hits, "disk_hits": query_cache.disk_hits, "misses": query_cache.misses},
+            "result_cache": {"hits": result_cache.hits, "disk_hits": result_cache.disk_hits, "misses": result_cache.misses}
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    # GET /health returns the server status, POST /search a JSON request {"method": "rrf" | "weighted" |
+    # "chunked", "queries": [...], and the k, alpha, limit, nprobe or pooling of the method} and answers
+    # {"results": [...]} with the ranked results of every query
+    def do_GET(self):
+        if self.path == "/health":
+            self.__reply(200, self.server.status())
+        else:
+            self.__reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self.__reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            results = self.server.search(request)
+        except (KeyError, TypeError, ValueError) as e:
+            self.__reply(400, {"error": str(e) or type(e).__name__})
+            return
+        self.__reply(200, {"results": results})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def __reply(self, status, body):
+        data = json.dumps(body, default=json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def cmd_serve(host=SEARCH_SERVER_HOST, port=SEARCH_SERVER_PORT, quantization=EMBEDDING_QUANTIZATION, leg_workers=HYBRID_LEG_WORKERS, max_batch=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+    hybrid_search = HybridSearch(load_movies()["movies"], leg_workers, quantization)
+    # the model loads now rather than with the first query that misses the query cache
+    load_model(hybrid_search.semantic_search.model_name)
+    server = SearchServer((host, port), hybrid_search, max_batch, max_wait_ms)
+    print(f"Serving {len(hybrid_search.documents)} documents on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
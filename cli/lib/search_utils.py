@@ -1,18 +1,36 @@
 import os
 import json
 import string
-from nltk.stem import PorterStemmer
+from functools import lru_cache
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
 MOVIES_PATH = os.path.join(PROJECT_ROOT, "data","movies.json")
 CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+INDEX_DIR = os.path.join(CACHE_DIR, "keyword_index")
+# pickles written by the previous index format, only read by the converter
 INDEX_PATH = os.path.join(CACHE_DIR, "index.pkl")
 DOCMAP_PATH = os.path.join(CACHE_DIR, "docmap.pkl")
 TERM_FREQUENCIES_PATH = os.path.join(CACHE_DIR, "term_frequencies.pkl")
 DOC_LENGTH_PATH = os.path.join(CACHE_DIR, "doc_lengths.pkl")
 BM25_K1 = 1.5
 BM25_B = 0.75
+# threads HybridSearch runs its BM25 and semantic legs on, 1 runs them one after the other
+HYBRID_LEG_WORKERS = 2
+# the local search server the CLIs use when it runs, see search_server_cli.py
+SEARCH_SERVER_HOST = "127.0.0.1"
+SEARCH_SERVER_PORT = 8765
+# seconds a CLI waits for the server to answer before searching in its own process
+SEARCH_SERVER_CONNECT_TIMEOUT = 0.5
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, "search_results.sqlite3")
+# hybrid search results kept in memory, and seconds before a cached result is searched again
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 3600
+# results are also kept in RESULT_CACHE_PATH, shared by every process, at most RESULT_CACHE_DISK_SIZE of them
+RESULT_CACHE_DISK = True
+RESULT_CACHE_DISK_SIZE = 100_000
+STEM_CACHE_SIZE = 100_000
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
 
 def gemini_query_spell(query):
    return f"""Fix any spelling errors in this movie search query.
@@ -98,21 +116,36 @@ def load_movies():
     with open(MOVIES_PATH, "r") as file:
         return json.load(file)
     
+class Tokenizer:
+    def __init__(self, stem_cache_size=STEM_CACHE_SIZE):
+        # nltk takes a third of a second to import, only commands that tokenize pay for it
+        from nltk.stem import PorterStemmer
+        self.stopwords = frozenset(load_stopwords())
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def tokenize(self, text: str) -> list[str]:
+        words = process_string(text).split()
+        return [self.stem(word) for word in words if word not in self.stopwords]
+
+    def tokenize_with_positions(self, text: str) -> list[tuple[str, int]]:
+        # positions count every word, stopwords included, so a phrase keeps its gaps
+        words = process_string(text).split()
+        return [(self.stem(word), position) for position, word in enumerate(words) if word not in self.stopwords]
+
+    def tokenize_many(self, texts) -> list[list[str]]:
+        return [self.tokenize(text) for text in texts]
+
+_tokenizer = None
+
+def get_tokenizer() -> Tokenizer:
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = Tokenizer()
+    return _tokenizer
+
 def tokenization(text: str) -> list:
-    text = process_string(text)
-    words = text.split()
-    stopwords = load_stopwords()
-    filtered_words = list(filter(lambda word: word not in stopwords, words))
-    stemmed_words = []
-    stemmer = PorterStemmer()
-    for token in filtered_words:
-        stemmed_words.append(stemmer.stem(token))
-    return stemmed_words
+    return get_tokenizer().tokenize(text)
 
 def process_string(query) -> str:
-    punctuations = {}
-    for char in string.punctuation:
-        punctuations[char] = None
-
-    processed_query = query.translate(str.maketrans(punctuations)).lower()
-    return processed_query
\ No newline at end of file
+    return query.translate(PUNCTUATION_TABLE).lower()
\ No newline at end of file
@@ -1,35 +1,63 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from lib import semantic_search_util as util
+from lib.top_k import top_k_indices
+from lib.semantic_search_util import EMBEDDING_QUANTIZATION, EMBED_WORKERS, RESCORE_CANDIDATES_PER_RESULT, normalize_rows
+from lib.quantization import load_or_quantize, remove_quantized, rescore
+from lib.query_cache import shared_query_cache
+from lib.embedding_encoder import EmbeddingEncoder, load_model
+import json
+import os
 import re
 
 class SemanticSearch:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name='all-MiniLM-L6-v2', quantization=EMBEDDING_QUANTIZATION, encode_workers=EMBED_WORKERS):
+        self.model_name = model_name
+        self.query_cache = shared_query_cache(model_name)
+        self.quantization = quantization
+        self.encode_workers = encode_workers
         self.embeddings = None
+        self.embedding_matrix = None
+        self.quantized = None
         self.documents = None
         self.document_map = {}
+        # set by the search server, encodes the query cache misses of concurrent requests in shared batches
+        self.query_batcher = None
+
+    @property
+    def model(self):
+        # loaded on first use: unchanged embeddings and queries found in the query cache never need it
+        return load_model(self.model_name)
 
     def search(self, query, limit) -> list[dict]:
+        return self.search_many([query], limit)[0]
+
+    def search_many(self, queries, limit) -> list[list[dict]]:
+        # every query is encoded in one model call and, unquantized, scored in one matrix product
         if self.embeddings is None:
             raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
-        query_embedding = self.generate_embedding(query)
-        similarity_score_document = []
-        for i,_ in enumerate(self.documents):
-            document = self.documents[i]
-            embedding = self.embeddings[i]
-            cos_sim = cosine_similarity(query_embedding, embedding)
-            similarity_score_document.append((cos_sim, document))
-
-        sorted_doc_score = sorted(similarity_score_document,key=lambda item: item[0], reverse=True)
+        if len(queries) == 0:
+            return []
+        query_matrix = normalize_rows(self.generate_embeddings(queries))
+        all_rows = np.arange(len(self.embeddings))
+        if self.quantized is None:
+            score_matrix = query_matrix @ self.embedding_matrix.T
+
         results = []
-        for i in range(limit):
-            results.append({
-                "score": sorted_doc_score[i][0],
-                "title": sorted_doc_score[i][1]["title"], 
-                "description": sorted_doc_score[i][1]["description"]
-                }
-            )
+        for j, query_embedding in enumerate(query_matrix):
+            if self.quantized is None:
+                rows, scores = all_rows, score_matrix[j]
+            else:
+                rows, scores = rescore(self.embeddings, query_embedding, all_rows, self.quantized @ query_embedding, limit * RESCORE_CANDIDATES_PER_RESULT)
+            query_results = []
+            for i in top_k_indices(scores, limit).tolist():
+                row = rows[i]
+                query_results.append({
+                    "score": scores[i],
+                    "title": self.documents[row]["title"], 
+                    "description": self.documents[row]["description"]
+                    }
+                )
+            results.append(query_results)
         return results
     
     def build_embedding(self, documents):
@@ -38,28 +66,115 @@ class SemanticSearch:
         for doc in documents:
             self.document_map[doc['id']] = doc
             document_lst.append(f"{doc['title']}: {doc['description']}")
-        self.embeddings = self.model.encode(document_lst, show_progress_bar=True)
+        self.encode_cached(util.content_keys(document_lst, self.model_name), document_lst, util.MOVIE_EMBEDDINGS_PATH)
+        self.embeddings, self.embedding_matrix, self.quantized = self.open_embeddings(util.MOVIE_EMBEDDINGS_PATH)
         return self.embeddings
     
     def load_or_create_embeddings(self, documents):
-        self.documents = documents
-        document_lst = []
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
-            document_lst.append(f"{doc['title']}: {doc['description']}")
-        if util.embeddings_file_exist():
-            self.embeddings = np.load(util.MOVIE_EMBEDDINGS_PATH)
-            if len(self.embeddings) == len(documents):
-                return self.embeddings
+        # cached rows are reused by content, so loading only encodes documents that are new or edited
         return self.build_embedding(documents)
 
+    def encode_cached(self, keys, texts, path) -> bool:
+        # keys are util.content_keys of the texts, an iterable read once in row order. Rows of the file at
+        # path whose key is still wanted are reused; the other texts are encoded by an EmbeddingEncoder in
+        # windows of EMBED_CHECKPOINT_BATCHES batches into a preallocated memory-mapped file that is
+        # checkpointed after every window, so an interrupted build of the same keys resumes at its last
+        # checkpoint. Returns whether the file at path was rewritten
+        cached, cached_rows = None, {}
+        if util.file_exist(path) and util.file_exist(util.keys_path(path)):
+            cached_keys = np.load(util.keys_path(path))
+            if np.array_equal(cached_keys, keys):
+                return False
+            cached = util.open_embeddings(path)
+            if len(cached) == len(cached_keys):
+                cached_rows = dict(zip(cached_keys.tolist(), range(len(cached_keys))))
+        rows = np.array([cached_rows.get(key, -1) for key in keys.tolist()], dtype=np.int64)
+        missing = np.flatnonzero(rows < 0)
+        reused = np.flatnonzero(rows >= 0)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path, partial_keys_path, checkpoint_path = util.partial_paths(path)
+        encoded_count = 0
+        if util.file_exist(checkpoint_path) and util.file_exist(partial_keys_path) and np.array_equal(np.load(partial_keys_path), keys):
+            embeddings = np.lib.format.open_memmap(partial_path, mode="r+")
+            with open(checkpoint_path, "r") as f:
+                encoded_count = json.load(f)["encoded"]
+            print(f"Resuming after {encoded_count} of {len(missing)} encoded texts")
+        else:
+            dimensions = cached.shape[1] if cached is not None and len(missing) == 0 else self.model.get_sentence_embedding_dimension()
+            embeddings = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.float32, shape=(len(keys), dimensions))
+            util.save_array(partial_keys_path, keys)
+        for start in range(0, len(reused), util.EMBED_BATCH_SIZE * util.EMBED_CHECKPOINT_BATCHES):
+            block = reused[start:start + util.EMBED_BATCH_SIZE * util.EMBED_CHECKPOINT_BATCHES]
+            embeddings[block] = cached[rows[block]]
+
+        def checkpoint(count):
+            embeddings.flush()
+            with open(f"{checkpoint_path}.tmp", "w") as f:
+                json.dump({"encoded": count}, f)
+            os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+        # texts of the rows still to encode, in row order, after the ones a resumed build already wrote
+        window_size = util.EMBED_BATCH_SIZE * util.EMBED_CHECKPOINT_BATCHES
+        pending = iter(missing[encoded_count:].tolist())
+        next_row = next(pending, None)
+        window_rows, window_texts = [], []
+        with EmbeddingEncoder(self.model_name, self.encode_workers) as encoder:
+            for row, text in enumerate(texts):
+                if next_row is None:
+                    break
+                if row != next_row:
+                    continue
+                window_rows.append(row)
+                window_texts.append(text)
+                next_row = next(pending, None)
+                if len(window_rows) == window_size or next_row is None:
+                    embeddings[window_rows] = util.normalize_rows(encoder.encode(window_texts))
+                    encoded_count += len(window_rows)
+                    window_rows, window_texts = [], []
+                    checkpoint(encoded_count)
+                    print(f"Encoded {encoded_count} of {len(missing)} texts, {encoder.throughput:.1f} texts/sec")
+        embeddings.flush()
+        del embeddings
+
+        # without a keys file every row is encoded again, so a crash between the writes costs time only
+        if util.file_exist(util.keys_path(path)):
+            os.remove(util.keys_path(path))
+        os.replace(partial_path, path)
+        util.save_array(util.keys_path(path), keys)
+        os.remove(partial_keys_path)
+        if util.file_exist(checkpoint_path):
+            os.remove(checkpoint_path)
+        remove_quantized(path)
+        print(f"Encoded {len(missing)} of {len(keys)} texts, reused {len(reused)} cached embeddings")
+        return True
+
+    def open_embeddings(self, path):
+        # returns the memory-mapped embeddings, the matrix searched exactly and the quantized codes. Quantized,
+        # the codes are searched and the mapped rows are only read to rescore candidates
+        embeddings = util.open_embeddings(path)
+        if self.quantization is None:
+            return embeddings, embeddings, None
+        return embeddings, None, load_or_quantize(path, embeddings, self.quantization)
+
     def generate_embedding(self, text):
         if self.__is_text_valid(text):
-            encode_param_lst = [text]
-            return self.model.encode(encode_param_lst)[0]
+            return self.query_cache.get_or_compute(text, lambda query: self.__encode_queries([query])[0])
         else:
             raise ValueError("Empty text")
 
+    def generate_embeddings(self, texts) -> np.ndarray:
+        # one row per text; texts missing from the query cache are encoded in a single batch
+        for text in texts:
+            if not self.__is_text_valid(text):
+                raise ValueError("Empty text")
+        return np.stack(self.query_cache.get_or_compute_many(texts, self.__encode_queries))
+
+    def __encode_queries(self, queries):
+        if self.query_batcher is not None:
+            return self.query_batcher.encode(queries)
+        return list(self.model.encode(queries))
+
     def __is_text_valid(self, text):
         if len(text) == 0 or text.isspace():
             return False
@@ -115,9 +230,9 @@ def cmd_chunck(text, chunk_size, overlap):
     for i, text in enumerate(results, start=1):
         print(f"{i}. {text}")
 
-def cmd_search(query, limit):
+def cmd_search(query, limit, quantization=EMBEDDING_QUANTIZATION):
     movie_list = util.load_movies()
-    semantic_search = SemanticSearch()
+    semantic_search = SemanticSearch(quantization=quantization)
     semantic_search.load_or_create_embeddings(movie_list["movies"])
     results = semantic_search.search(query, limit)
     print(results)
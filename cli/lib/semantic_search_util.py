@@ -1,12 +1,49 @@
 import os
 import json
+import hashlib
+import numpy as np
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 MOVIE_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
 MOVIES_PATH = os.path.join(PROJECT_ROOT, "data","movies.json")
 CHUNK_EMBEDDINGS = os.path.join(PROJECT_ROOT, "cache/chunk_embeddings.npy")
-CHUNK_METADATA = os.path.join(PROJECT_ROOT, "cache/chunk_metadata.json")
+# int32 rows movie_idx, chunk_idx and total_chunks, one column per chunk
+CHUNK_METADATA = os.path.join(PROJECT_ROOT, "cache/chunk_metadata.npy")
+# content keys of the descriptions the chunk files were built from
+CHUNK_DOCUMENT_KEYS = os.path.join(PROJECT_ROOT, "cache/chunk_document_keys.npy")
+CHUNK_MOVIE_IDX, CHUNK_IDX, CHUNK_TOTAL = 0, 1, 2
+CHUNK_IVF_INDEX = os.path.join(PROJECT_ROOT, "cache/chunk_ivf_index.npz")
+# inverted lists scanned per query, 0 scores every chunk. Probing is opt-in: its recall on real embeddings
+# is unmeasured and an exhaustive scan is as fast on a corpus of this size
+IVF_NPROBE = 0
+# how search_chunks turns chunk scores into a movie score: best chunk, mean of its chunks or sum of its top n
+CHUNK_POOLING = "max"
+CHUNK_POOLING_MODES = ["max", "mean", "top_n"]
+CHUNK_POOLING_TOP_N = 2
+IVF_ITERATIONS = 10
+IVF_TRAIN_SAMPLES_PER_LIST = 256
+QUERY_CACHE_PATH = os.path.join(CACHE_DIR, "query_embeddings.sqlite3")
+# query embeddings kept in memory per model, older ones are read back from QUERY_CACHE_PATH
+QUERY_CACHE_SIZE = 1024
+# rows kept in QUERY_CACHE_PATH for every model together, about 1.5 KB each; the oldest written are dropped first
+QUERY_CACHE_DISK_SIZE = 100_000
+# the search server encodes the queries of concurrent requests together, up to this many texts per model call
+# and waiting at most this long for more after the first
+QUERY_BATCH_SIZE = 64
+QUERY_BATCH_WAIT_MS = 5
+# texts encoded per model call while building embeddings, and batches between checkpoints
+EMBED_BATCH_SIZE = 256
+EMBED_CHECKPOINT_BATCHES = 16
+# processes encoding a corpus, each loads its own copy of the model
+EMBED_WORKERS = 1
+# compressed copy searched in memory: None, "float16", "int8" or "pq"; full precision rows stay on disk
+EMBEDDING_QUANTIZATION = None
+# approximate candidates rescored at full precision per requested result
+RESCORE_CANDIDATES_PER_RESULT = 10
+PQ_SUBSPACE_DIMS = 4
+PQ_TRAIN_SAMPLES = 16384
+PQ_ITERATIONS = 10
 
 def embeddings_file_exist():
     return os.path.exists(MOVIE_EMBEDDINGS_PATH)
@@ -16,4 +53,47 @@ def file_exist(path):
 
 def load_movies():
     with open(MOVIES_PATH, "r") as file:
-        return json.load(file)
\ No newline at end of file
+        return json.load(file)
+
+def normalize_rows(embeddings) -> np.ndarray:
+    # unit length float32 rows, so a dot product is the cosine similarity; all zero rows stay zero and score 0
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.ascontiguousarray(np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0))
+
+def normalize_vector(vector) -> np.ndarray:
+    return normalize_rows(np.asarray(vector)[np.newaxis, :])[0]
+
+def content_key(text, model_name) -> int:
+    # 64 bit blake2b digest of the model name and the text, an embedding is only reused for the same pair
+    return int.from_bytes(hashlib.blake2b(f"{model_name}\0{text}".encode(), digest_size=8).digest(), "little")
+
+def content_keys(texts, model_name) -> np.ndarray:
+    return np.fromiter((content_key(text, model_name) for text in texts), dtype=np.uint64)
+
+def keys_path(embeddings_path):
+    return f"{os.path.splitext(embeddings_path)[0]}.keys.npy"
+
+def partial_paths(embeddings_path):
+    # rows of an unfinished build, the keys it builds and its checkpoint
+    base = os.path.splitext(embeddings_path)[0]
+    return f"{base}.partial.npy", f"{base}.partial.keys.npy", f"{base}.partial.json"
+
+def save_array(path, array):
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+def save_embeddings(path, embeddings):
+    # stored as unit length float32 rows, so searches score the memory-mapped file without a normalized copy
+    save_array(path, normalize_rows(embeddings))
+
+def open_embeddings(path) -> np.ndarray:
+    # read-only mapping, processes opening the same file share its pages. The model emits unit length rows,
+    # a file whose first rows are not normalized is rewritten once
+    embeddings = np.load(path, mmap_mode="r")
+    norms = np.linalg.norm(embeddings[:16], axis=1)
+    if embeddings.dtype != np.float32 or not np.all((np.abs(norms - 1) < 1e-4) | (norms == 0)):
+        save_embeddings(path, embeddings)
+        embeddings = np.load(path, mmap_mode="r")
+    return embeddings.view(np.ndarray)
\ No newline at end of file
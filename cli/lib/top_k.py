@@ -0,0 +1,19 @@
+import numpy as np
+
+
+def top_k_indices(scores, k) -> np.ndarray:
+    # indices of the k highest scores, best first, in O(n + k log k). Equal scores keep the lower index
+    # first, the order a stable sort by descending score gives, also for ties straddling the k-th place
+    scores = np.asarray(scores)
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        kth_score = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth_score)
+        tied = np.flatnonzero(scores == kth_score)[:k - len(above)]
+        selected = np.concatenate((above, tied))
+    else:
+        selected = np.arange(n)
+    return selected[np.lexsort((selected, -scores[selected]))]
+
@@ -0,0 +1,39 @@
+import argparse
+import json
+from lib.search_server import cmd_serve
+from lib.search_client import SearchClient
+from lib.search_utils import SEARCH_SERVER_HOST, SEARCH_SERVER_PORT, HYBRID_LEG_WORKERS
+from lib.semantic_search_util import EMBEDDING_QUANTIZATION, QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS
+from lib.quantization import QUANTIZATION_KINDS
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Server CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser("serve", help="Keep the hybrid search loaded and answer the other CLIs")
+    serve_parser.add_argument("--host", type=str, default=SEARCH_SERVER_HOST, help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=SEARCH_SERVER_PORT, help="Port to listen on")
+    serve_parser.add_argument("--quantization", choices=QUANTIZATION_KINDS, default=EMBEDDING_QUANTIZATION, help="Search compressed embeddings and rescore the best at full precision")
+    serve_parser.add_argument("--leg-workers", type=int, default=HYBRID_LEG_WORKERS, help="Threads running the BM25 and semantic legs")
+    serve_parser.add_argument("--max-batch", type=int, default=QUERY_BATCH_SIZE, help="Most queries encoded in one model call")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=QUERY_BATCH_WAIT_MS, help="Longest wait for more queries to encode together")
+
+    status_parser = subparsers.add_parser("status", help="Show whether a search server runs and its counters")
+    status_parser.add_argument("--host", type=str, default=SEARCH_SERVER_HOST, help="Address of the server")
+    status_parser.add_argument("--port", type=int, default=SEARCH_SERVER_PORT, help="Port of the server")
+
+    args = parser.parse_args()
+    match args.command:
+        case "serve":
+            cmd_serve(args.host, args.port, args.quantization, args.leg_workers, args.max_batch, args.max_wait_ms)
+        case "status":
+            status = SearchClient(args.host, args.port).status()
+            if status is None:
+                print(f"No search server running on {args.host}:{args.port}")
+            else:
+                print(json.dumps(status, indent=2))
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 import argparse
 from lib.semantic_search import verify_model, embed_text, verify_embeddings, embed_query_text, cmd_search, cmd_chunck,cmd_sematic_chunk 
 from lib.chunked_semantic_search import cmd_embed_chunks, cmd_search_chunked
+from lib.semantic_search_util import IVF_NPROBE, EMBEDDING_QUANTIZATION, EMBED_WORKERS, CHUNK_POOLING, CHUNK_POOLING_MODES
+from lib.quantization import QUANTIZATION_KINDS
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
@@ -20,6 +22,7 @@ def main():
     search_parser = subparsers.add_parser(name="search", help="Search for similairities")
     search_parser.add_argument("query", type=str, help="Query to search for")
     search_parser.add_argument("--limit", type=int,  default=5, help="Limit for query return") 
+    search_parser.add_argument("--quantization", choices=QUANTIZATION_KINDS, default=EMBEDDING_QUANTIZATION, help="Search compressed embeddings and rescore the best at full precision")
 
     chunk_parser = subparsers.add_parser(name="chunk", help="Split query into chunks")
     chunk_parser.add_argument("text", type=str, help="Text to split into chunks")
@@ -31,11 +34,15 @@ def main():
     semantic_chunk_parser.add_argument("--max-chunk-size", type=int, default=4, help="Max chunk size to split one")
     semantic_chunk_parser.add_argument("--overlap", type=int, default=0, help="Default option for overlapping words")
 
-    subparsers.add_parser(name="embed_chunks", help="Generate chunk embeddings")
+    embed_chunks_parser = subparsers.add_parser(name="embed_chunks", help="Generate chunk embeddings")
+    embed_chunks_parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="Processes encoding chunks, each loads its own model")
 
     search_chunked_parser = subparsers.add_parser(name="search_chunked", help="Search for chunked query")   
     search_chunked_parser.add_argument("query", type=str, help="Query for search for")
     search_chunked_parser.add_argument("--limit", type=int, default=5, help="Limit for results defaults to 5")
+    search_chunked_parser.add_argument("--nprobe", type=int, default=IVF_NPROBE, help="ANN lists to scan per query, 0 searches every chunk")
+    search_chunked_parser.add_argument("--pooling", choices=CHUNK_POOLING_MODES, default=CHUNK_POOLING, help="How chunk scores combine into a movie score")
+    search_chunked_parser.add_argument("--quantization", choices=QUANTIZATION_KINDS, default=EMBEDDING_QUANTIZATION, help="Search compressed embeddings and rescore the best at full precision")
 
     args = parser.parse_args()
     match args.command:
@@ -48,7 +55,7 @@ def main():
         case "embedquery":
             embed_query_text(args.query)
         case "search":
-            cmd_search(args.query, args.limit)
+            cmd_search(args.query, args.limit, args.quantization)
         case "chunk":
             cmd_chunck(args.text, args.chunk_size, args.overlap)
         case "semantic_chunk":
@@ -56,9 +63,9 @@ def main():
             for i, text in enumerate(results, start=1):
                 print(f"{i}. {text}")
         case "embed_chunks":
-            cmd_embed_chunks()
+            cmd_embed_chunks(args.workers)
         case "search_chunked":
-            cmd_search_chunked(args.query, args.limit)
+            cmd_search_chunked(args.query, args.limit, args.nprobe, args.quantization, args.pooling)
         case _:
             parser.print_help()
 
@@ -0,0 +1,71 @@
+import functools
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from lib import search_utils
+from lib.hybrid_search import HybridSearch
+from lib.inverted_index import InvertedIndex
+
+
+def setUpModule():
+    # the stopwords list ships with the movie data, not with the repo
+    with mock.patch.object(search_utils, "load_stopwords", return_value=["the", "a", "of", "and", "in"]):
+        search_utils._tokenizer = search_utils.Tokenizer()
+
+
+def tearDownModule():
+    search_utils._tokenizer = None
+
+
+class KeywordOnlySemanticSearch:
+    # a semantic leg that never matches, so the results come from the keyword index alone
+    version = "semantic"
+
+    def __init__(self, quantization=None):
+        pass
+
+    def load_or_create_chunk_embeddings(self, documents):
+        pass
+
+    def rank_chunks_many(self, queries, limit, nprobe):
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+        return [empty for _ in queries]
+
+
+def movie(doc_id, description):
+    return {"id": doc_id, "title": f"Movie {doc_id}", "description": description}
+
+
+class HybridSearchTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index_dir = directory.name
+        for target, value in (("InvertedIndex", functools.partial(InvertedIndex, self.index_dir)), ("ChunkedSemanticSearch", KeywordOnlySemanticSearch)):
+            patcher = mock.patch(f"lib.hybrid_search.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_rebuilt_index_is_searched_and_cached_under_its_version(self):
+        documents = [movie(doc_id, f"a story of the bear number {doc_id} in the woods") for doc_id in range(1, 11)]
+        hybrid_search = HybridSearch(documents, leg_workers=1, result_cache_disk=False)
+        # nothing matches, the keyword leg pads the results with the first documents
+        self.assertNotEqual(hybrid_search.rrf_search("whale", 60, 5)[0]["id"], 4)
+        version = hybrid_search.version
+
+        # removed and built again, the new index starts from version 1 as well
+        shutil.rmtree(self.index_dir)
+        rebuilt = InvertedIndex(self.index_dir)
+        rebuilt.build(documents[:3] + [movie(4, "a lonely whale song")] + documents[4:])
+        rebuilt.save()
+
+        self.assertEqual(hybrid_search.rrf_search("whale", 60, 5)[0]["id"], 4)
+        self.assertNotEqual(hybrid_search.version, version)
+        results, timings = hybrid_search.rrf_search_many_with_timings(["whale"], 60, 5)
+        self.assertEqual(results[0][0]["id"], 4)
+        self.assertEqual(timings, [{"cached": True}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from lib import search_utils
+from lib.inverted_index import InvertedIndex
+
+
+def setUpModule():
+    # the stopwords list ships with the movie data, not with the repo
+    with mock.patch.object(search_utils, "load_stopwords", return_value=["the", "a", "of", "and", "in"]):
+        search_utils._tokenizer = search_utils.Tokenizer()
+
+
+def tearDownModule():
+    search_utils._tokenizer = None
+
+
+def movie(doc_id, description):
+    return {"id": doc_id, "title": f"Movie {doc_id}", "description": description}
+
+
+def movies(count):
+    return [movie(doc_id, f"a story of the bear number {doc_id} in the woods") for doc_id in range(1, count + 1)]
+
+
+class InvertedIndexTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index_dir = directory.name
+
+    def build(self, documents, positions=False):
+        index = InvertedIndex(self.index_dir)
+        index.build(documents, positions=positions)
+        index.save()
+        return index
+
+    def test_merge_skips_fully_deleted_positional_segment(self):
+        index = self.build(movies(10), positions=True)
+        index.add_documents([movie(5000, "a grizzly bear attack")])
+        index.add_documents([movie(5001, "a lonely whale song")])
+        index.delete_documents([5000])
+        index.merge()
+        self.assertEqual(len(index.manifest["segments"]), 1)
+        self.assertEqual(len(index.reader), 11)
+        self.assertEqual([result["id"] for result in index.phrase_search("whale song", 5)], [5001])
+        self.assertEqual(index.phrase_search("grizzly bear", 5), [])
+        self.assertEqual([result["id"] for result in index.phrase_search("bear number 7", 5)], [7])
+
+    def test_refresh_reloads_rebuilt_index(self):
+        # a removed and rebuilt index starts again from version 1
+        self.build(movies(10))
+        resident = InvertedIndex(self.index_dir)
+        resident.load()
+        shutil.rmtree(self.index_dir)
+        self.build(movies(70))
+        self.assertTrue(resident.refresh())
+        self.assertEqual(len(resident.reader), 70)
+        self.assertFalse(resident.refresh())
+        shutil.rmtree(self.index_dir)
+        self.assertFalse(resident.refresh())
+        self.assertEqual(len(resident.reader), 70)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+from lib.query_cache import QueryEmbeddingCache
+
+
+def embed(queries):
+    return [np.full(4, len(query), dtype=np.float32) for query in queries]
+
+
+class QueryEmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "query_embeddings.sqlite3")
+
+    def stored_queries(self):
+        with sqlite3.connect(self.path) as connection:
+            return [row[0] for row in connection.execute("SELECT query FROM query_embeddings ORDER BY rowid")]
+
+    def test_disk_keeps_the_last_written_embeddings(self):
+        cache = QueryEmbeddingCache("model", self.path, capacity=2, disk_capacity=3)
+        cache.get_or_compute_many(["bear", "whale", "shark"], embed)
+        cache.get_or_compute_many(["wolf", "whale  "], embed)
+        cache.get_or_compute_many(["eagle"], embed)
+        self.assertEqual(self.stored_queries(), ["shark", "wolf", "eagle"])
+
+        reopened = QueryEmbeddingCache("model", self.path, capacity=2, disk_capacity=3)
+        computed = []
+
+        def recording_embed(queries):
+            computed.extend(queries)
+            return embed(queries)
+
+        embeddings = reopened.get_or_compute_many(["wolf", "bear"], recording_embed)
+        self.assertEqual(computed, ["bear"])
+        self.assertEqual(reopened.disk_hits, 1)
+        np.testing.assert_array_equal(embeddings[0], embed(["wolf"])[0])
+        self.assertEqual(len(self.stored_queries()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()